@@ -0,0 +1,166 @@
+'''
+LDTP v2 benchmarks, run against a live desktop
+
+Usage: python benchmark.py [benchmark name ...]
+
+@license: LGPL
+
+http://ldtp.freedesktop.org
+
+This file may be distributed and/or modified under the terms of the GNU Lesser General
+Public License version 2 as published by the Free Software Foundation. This file
+is distributed without any warranty; without even the implied warranty of
+merchantability or fitness for a particular purpose.
+
+See "COPYING" in the source distribution for more information.
+
+Headers in this file shall remain intact.
+'''
+
+import os
+import sys
+import time
+import zlib
+import shutil
+import tempfile
+import ldtp
+import ldtputils
+try:
+    import xmlrpclib
+except ImportError:
+    import xmlrpc.client as xmlrpclib
+
+def _gzip(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def bench_gzip():
+    """
+    Size and CPU cost of gzip encoding real imagecapture / getobjectlist
+    responses, as sent by ldtpd
+    """
+    ldtp.launchapp('gedit')
+    ldtp.waittillguiexist('*gedit')
+    payloads = [('imagecapture', ldtp._remote_imagecapture('', 0, 0, -1, -1)),
+                ('getobjectlist', ldtp.getobjectlist('*gedit'))]
+    for name, result in payloads:
+        data = xmlrpclib.dumps((result,), methodresponse=True)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        for level in (1, 6, 9):
+            start = time.time()
+            encoded = _gzip(data, level)
+            elapsed = time.time() - start
+            print('%-14s level %d: %9d -> %9d bytes (%5.1f%%) in %7.2f ms' % \
+                      (name, level, len(data), len(encoded),
+                       len(encoded) * 100.0 / len(data), elapsed * 1000))
+    ldtp.selectmenuitem('*gedit', 'mnuQuit')
+
+def bench_imagecapture(duration=5):
+    """
+    Captures per second at 1080p and 4K, per image format. ldtpd clips
+    the region to the desktop, so 4K needs a desktop at least that big
+    """
+    for width, height in ((1920, 1080), (3840, 2160)):
+        for image_format, quality in (('png', -1), ('png', 1),
+                                      ('jpeg', 80), ('raw', -1)):
+            count = 0
+            size = 0
+            start = time.time()
+            while time.time() - start < duration:
+                data = ldtp._remote_imagecapture('', 0, 0, width, height,
+                                                 image_format, quality)
+                size = len(data)
+                count += 1
+            elapsed = time.time() - start
+            print('%4dx%-4d %-4s quality %3d: %6.2f captures/s, %9d bytes' % \
+                      (width, height, image_format, quality,
+                       count / elapsed, size))
+
+def bench_imagecompare(repeat=3):
+    """
+    ldtputils.imagecompare, vectorized engine against the legacy pixel
+    loop, on synthetic 1080p PNG pairs. Needs PIL and numpy, no desktop
+    """
+    Image, ImageChops = ldtputils._import_pil()
+    width, height = 1920, 1080
+    base = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    small = base.copy()
+    small.paste((255, 0, 0), (100, 100, 300, 200))
+    full = ImageChops.invert(base)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = {}
+        for name, image in (('base', base), ('small', small), ('full', full)):
+            files[name] = os.path.join(tmpdir, name + '.png')
+            image.save(files[name])
+        for case in ('small', 'full'):
+            for engine, func in (('legacy', ldtputils._imagecompare_legacy),
+                                 ('numpy', ldtputils.imagediff)):
+                start = time.time()
+                for i in range(repeat):
+                    percent = func(files['base'], files[case])[0]
+                elapsed = (time.time() - start) / repeat
+                print('%-5s diff %-6s: %8.2f ms, %6.2f%% different' % \
+                          (case, engine, elapsed * 1000, percent))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def bench_resolve(rounds=5):
+    """
+    Time to resolve a dialog and one of its widgets, right after the
+    action that opens it, with gedit's Open dialog
+    """
+    ldtp.launchapp('gedit')
+    ldtp.waittillguiexist('*gedit')
+    total = 0.0
+    for i in range(rounds):
+        ldtp.activatewindow('*gedit')
+        start = time.time()
+        ldtp.generatekeyevent('<ctrl>o')
+        # Window and object lookups wait for the dialog themselves
+        ldtp.getobjectinfo('dlg*Open*', 'btnCancel')
+        elapsed = time.time() - start
+        total += elapsed
+        print('round %d: resolved in %7.1f ms' % (i + 1, elapsed * 1000))
+        ldtp.click('dlg*Open*', 'btnCancel')
+        ldtp.waittillguinotexist('dlg*Open*')
+    print('mean     : resolved in %7.1f ms' % (total * 1000 / rounds))
+    ldtp.selectmenuitem('*gedit', 'mnuQuit')
+
+def bench_enterstring(length=2048):
+    """
+    Characters per second typed into gedit by enterstring, per path:
+    a key event with a pause per character, batched key events, and
+    EditableText insertion. Slow paths type a shorter string
+    """
+    ldtp.launchapp('gedit')
+    ldtp.waittillguiexist('*gedit')
+    line = 'The quick brown fox jumps over the lazy dog 0123456789.'
+    text = (line * (length // len(line) + 1))[:length]
+    for path, chars, object_name, fast in (('keys', 256, 'txt1', 0),
+                                           ('batched keys', 512, '', 1),
+                                           ('insert text', length, 'txt1', 1)):
+        ldtp.settextvalue('*gedit', 'txt1', '')
+        if not object_name:
+            # No object given, fast mode falls back to key events
+            ldtp.grabfocus('*gedit', 'txt1')
+        start = time.time()
+        ldtp.enterstring('*gedit', object_name, text[:chars], fast)
+        elapsed = time.time() - start
+        typed = len(ldtp.gettextvalue('*gedit', 'txt1'))
+        print('%-12s: %5d chars in %7.2f s, %9.1f chars/s, %5d in text' % \
+                  (path, chars, elapsed, chars / elapsed, typed))
+    ldtp.settextvalue('*gedit', 'txt1', '')
+    ldtp.selectmenuitem('*gedit', 'mnuQuit')
+
+benchmarks = {'enterstring' : bench_enterstring,
+              'gzip' : bench_gzip,
+              'imagecapture' : bench_imagecapture,
+              'imagecompare' : bench_imagecompare,
+              'resolve' : bench_resolve}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or sorted(benchmarks.keys()):
+        print('== %s' % name)
+        benchmarks[name]()
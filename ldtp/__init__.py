@@ -25,6 +25,7 @@ import sys
 import time
 import atexit
 import socket
+import mmap
 import logging
 import datetime
 import tempfile
@@ -41,7 +42,7 @@ sys.path.append(path)
 
 from ldtp import state
 from ldtp import client
-from ldtp.client_exception import LdtpExecutionError
+from ldtp.client_exception import LdtpExecutionError, LdtpAppExitedError
 
 _t = None
 _pollEvents = None
@@ -52,6 +53,9 @@ _ldtp_windows_env = client._ldtp_windows_env
 if 'LDTP_DEBUG' in os.environ:
     _ldtp_debug = os.environ['LDTP_DEBUG']
 
+# File extension for each imagecapture format
+_image_suffix = {'png' : 'png', 'jpeg' : 'jpg', 'jpg' : 'jpg', 'raw' : 'ppm'}
+
 def setHost(host):
     client._client.setHost(host)
 
@@ -362,7 +366,8 @@ class PollEvents(threading.Thread):
         return True
 
 def imagecapture(window_name = None, out_file = None, x = 0, y = 0,
-                 width = None, height = None):
+                 width = None, height = None, image_format = 'png',
+                 quality = -1, stream = False):
     """
     Captures screenshot of the whole desktop or given window
 
@@ -377,12 +382,22 @@ def imagecapture(window_name = None, out_file = None, x = 0, y = 0,
     @type width: integer
     @param height: height co-ordinate value
     @type height: integer
+    @param image_format: png, jpeg or raw (uncompressed RGB, binary PPM)
+    @type image_format: string
+    @param quality: PNG compression level 0 - 9 or JPEG quality 0 - 100,
+    -1 for the default. Use a low PNG level or raw for fast snapshots.
+    @type quality: integer
+    @param stream: Download the screenshot with HTTP GET in chunks,
+    instead of base64 in the XML-RPC response. Keeps client memory flat
+    for large captures, Linux ldtpd only.
+    @type stream: boolean
 
     @return: screenshot filename
     @rtype: string
     """
     if not out_file:
-        out_file = tempfile.mktemp('.png', 'ldtp_')
+        suffix = _image_suffix.get(image_format, image_format)
+        out_file = tempfile.mktemp('.%s' % suffix, 'ldtp_')
     else:
         out_file = os.path.expanduser(out_file)
 
@@ -395,13 +410,75 @@ def imagecapture(window_name = None, out_file = None, x = 0, y = 0,
         if window_name == None:
             window_name = ''
     ### Windows compatibility - End
-    data = _remote_imagecapture(window_name, x, y, width, height)
+    if stream:
+        # No local wrapper, so _populateNamespace binds the plain name
+        token = imagecapturestore(window_name, x, y, width, height,
+                                  image_format, quality)
+        return client._client.download('/imagecapture/%s' % token, out_file)
+    if image_format == 'png' and quality == -1:
+        # Keep the call compatible with Windows / Mac ldtpd
+        data = _remote_imagecapture(window_name, x, y, width, height)
+    else:
+        data = _remote_imagecapture(window_name, x, y, width, height,
+                                    image_format, quality)
     f = open(out_file, 'wb')
     f.write(b64decode(data))
     f.close()
 
     return out_file
 
+def imagecaptureshm(window_name = None, x = 0, y = 0, width = None,
+                    height = None, name = 'capture'):
+    """
+    Captures screenshot of the whole desktop or given window into
+    shared memory, without encoding, decoding or copying the pixels.
+    Works only when ldtpd runs on the same host. The next capture with
+    the same name overwrites the pixels in place.
+
+    @param window_name: Window name to look for, either full name,
+    LDTP's name convention, or a Unix glob.
+    @type window_name: string
+    @param x: x co-ordinate value
+    @type x: integer
+    @param y: y co-ordinate value
+    @type y: integer
+    @param width: width co-ordinate value
+    @type width: integer
+    @param height: height co-ordinate value
+    @type height: integer
+    @param name: Shared memory name, use different names to keep
+    multiple frames around
+    @type name: string
+
+    @return: (pixels, width, height, rowstride, channels, RGB / RGBA),
+    pixels is a read only NumPy array of shape (height, width, channels)
+    if NumPy is installed, else a flat buffer with rows rowstride apart
+    @rtype: tuple
+    """
+    info = _remote_imagecaptureshm(window_name, x, y, width, height, name)
+    path, width, height, rowstride, n_channels, mode = info[:6]
+    # The file only grows, pixels past length are from older captures
+    length = info[6]
+    if not os.path.exists(path):
+        raise LdtpExecutionError('%s does not exist, imagecaptureshm ' \
+                                     'requires ldtpd on the same host' % path)
+    f = open(path, 'rb')
+    try:
+        frame = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    finally:
+        f.close()
+    try:
+        import numpy
+        pixels = numpy.ndarray((height, width, n_channels), numpy.uint8,
+                               frame, 0, (rowstride, n_channels, 1))
+    except ImportError:
+        try:
+            pixels = memoryview(frame)[:length]
+        except TypeError:
+            # Python 2 mmap has only the old buffer interface
+            pixels = buffer(frame, 0, length)
+    return pixels, width, height, rowstride, n_channels, mode
+
 def wait(timeout=5):
     return _remote_wait(timeout)
 def waittillguiexist(window_name, object_name = '',
@@ -428,8 +505,11 @@ def doesrowexist(window_name, object_name, row_text, partial_match = False):
     return _remote_doesrowexist(window_name, object_name, row_text, partial_match)
 def getchild(window_name, child_name = '', role = '', parent = ''):
     return _remote_getchild(window_name, child_name, role, parent)
-def enterstring(window_name, object_name = '', data = ''):
-    return _remote_enterstring(window_name, object_name, data)
+def enterstring(window_name, object_name = '', data = '', fast = 0):
+    if not fast:
+        # Keep the call compatible with Windows / Mac ldtpd
+        return _remote_enterstring(window_name, object_name, data)
+    return _remote_enterstring(window_name, object_name, data, fast)
 def setvalue(window_name, object_name, data):
     return _remote_setvalue(window_name, object_name, float(data))
 def grabfocus(window_name, object_name = ''):
@@ -23,18 +23,24 @@ import os
 import re
 import sys
 import time
+import zlib
 import signal
 import platform
 import traceback
 import subprocess
 from socket import error as SocketError
 from ldtp.log import logger
-from ldtp.client_exception import LdtpExecutionError, ERROR_CODE
+from ldtp.client_exception import LdtpExecutionError, ERROR_CODE, \
+     LdtpAppExitedError, APP_EXITED_ERROR_CODE
 
 try:
     import xmlrpclib
 except ImportError:
     import xmlrpc.client as xmlrpclib
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
 _python3 = False
 _python26 = False
 if sys.version_info[:2] <= (2, 6):
@@ -65,6 +71,12 @@ if 'LDTP_WINDOWS' in os.environ or sys.platform.find('win') != -1:
         _ldtp_windows_env = True
 else:
    _ldtp_windows_env = False
+try:
+    # Payloads larger than this many bytes are gzip encoded,
+    # a negative value disables it
+    _ldtp_gzip_threshold = int(os.environ.get('LDTP_GZIP_THRESHOLD', 1400))
+except ValueError:
+    _ldtp_gzip_threshold = 1400
 
 class _Method(xmlrpclib._Method):
     def __call__(self, *args, **kwargs):
@@ -75,6 +87,13 @@ class _Method(xmlrpclib._Method):
         return self.__send(self.__name, args)
 
 class Transport(xmlrpclib.Transport):
+    # xmlrpclib sends Accept-Encoding: gzip based on this flag
+    accept_gzip_encoding = _ldtp_gzip_threshold >= 0
+    if _ldtp_gzip_threshold >= 0 and not _ldtp_windows_env and \
+            platform.mac_ver()[0] == '':
+        # Only Linux ldtpd understands gzip encoded requests
+        encode_threshold = _ldtp_gzip_threshold
+
     def _handle_signal(self, signum, frame):
         if _ldtp_debug:
             if signum == signal.SIGCHLD:
@@ -112,7 +131,6 @@ class Transport(xmlrpclib.Transport):
         # Add to the class, only if > python 2.5
         def make_connection(self, host):
             # create a HTTP connection object from a host descriptor
-            import httplib
             host, extra_headers, x509 = self.get_host_info(host)
             return httplib.HTTPConnection(host)
     ##
@@ -154,6 +172,10 @@ class Transport(xmlrpclib.Transport):
                                         response.reason, response.msg.headers)
 
                 payload = response.read()
+                if response.getheader('content-encoding', '') == 'gzip':
+                    # xmlrpclib.gzip_decode caps the size at 20MB, which
+                    # a multi-monitor imagecapture can exceed
+                    payload = zlib.decompress(payload, 16 + zlib.MAX_WBITS)
                 parser, unmarshaller = self.getparser()
                 parser.feed(payload)
                 parser.close()
@@ -196,6 +218,11 @@ class Transport(xmlrpclib.Transport):
                     self.close()
                 if e.faultCode == ERROR_CODE:
                     raise LdtpExecutionError(e.faultString.encode('utf-8'))
+                elif e.faultCode == APP_EXITED_ERROR_CODE:
+                    status = re.search(r'exited with status (-?\d+)',
+                                       e.faultString)
+                    raise LdtpAppExitedError(e.faultString.encode('utf-8'),
+                                             status and int(status.group(1)))
                 else:
                     raise e
 
@@ -230,5 +257,41 @@ class LdtpClient(xmlrpclib.ServerProxy):
     def setHost(self, host):
         setattr(self, '_ServerProxy__host', host)
 
+    def download(self, path, out_file, chunk_size=65536):
+        """
+        Download the given path from ldtpd with HTTP GET, writing
+        it to out_file in chunks
+
+        @param path: Path on ldtpd, ex: /imagecapture/<token>
+        @type path: string
+        @param out_file: File name to write
+        @type out_file: string
+        @param chunk_size: Bytes read from the socket at a time
+        @type chunk_size: integer
+
+        @return: out_file
+        @rtype: string
+        """
+        h = httplib.HTTPConnection(self._ServerProxy__host)
+        try:
+            h.request('GET', path)
+            response = h.getresponse()
+            if response.status != 200:
+                raise LdtpExecutionError('Unable to download %s: %d %s' % \
+                                             (path, response.status,
+                                              response.reason))
+            f = open(out_file, 'wb')
+            try:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            finally:
+                f.close()
+        finally:
+            h.close()
+        return out_file
+
 _client = LdtpClient('http://%s:%s' % (_ldtp_server_addr, _ldtp_server_port),
                      verbose = verbose)
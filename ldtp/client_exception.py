@@ -18,6 +18,15 @@ Headers in this file shall remain intact.
 """
 
 ERROR_CODE = 123
+APP_EXITED_ERROR_CODE = 124
 
 class LdtpExecutionError(Exception):
     pass
+
+class LdtpAppExitedError(LdtpExecutionError):
+    """
+    Application under test exited, exit_status holds its exit status
+    """
+    def __init__(self, message, exit_status=None):
+        LdtpExecutionError.__init__(self, message)
+        self.exit_status = exit_status
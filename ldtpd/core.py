@@ -45,9 +45,10 @@ from constants import abbreviated_roles
 from keypress_actions import KeyboardOp
 from waiters import ObjectExistsWaiter, GuiExistsWaiter, \
     GuiNotExistsWaiter, ObjectNotExistsWaiter, NullWaiter, \
-    MaximizeWindow, MinimizeWindow, UnmaximizeWindow, UnminimizeWindow, \
-    ActivateWindow, CloseWindow
+    WindowIndex, WindowStateWaiter, RegionStableWaiter, IdleWaiter, \
+    AppWindowWaiter, Waiter, ConditionsWaiter, StateWaiter
 from server_exception import LdtpServerException
+from script import Script
 import os
 import re
 import sys
@@ -82,6 +83,18 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         self._registered_events=[]
         pyatspi.Registry.registerEventListener(self._event_cb, *self._events)
         self._process_stats={}
+        # Screenshots stored by imagecapturestore, token: [data, mime type]
+        self._captured_images={}
+        self._captured_image_tokens=[]
+        # Last frame per region, used by imagecapturechanges
+        self._previous_frames={}
+        self._previous_frame_keys=[]
+        self._image_arrays={}
+        self._image_array_keys=[]
+        # wnck screen and window list, created on first window action
+        self._window_index=None
+        # Seconds to wait for wnck to confirm a window action
+        self._window_timeout=5
 
     def __del__(self):
         if '_events' in dir(self):
@@ -136,6 +149,7 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
             abbrev_role, abbrev_name, label_by=self._ldtpize_accessible( \
                 event.source)
             win_name='%s%s' % (abbrev_role, abbrev_name)
+            self._note_app_window(event.source, win_name)
             self._window_uptime[win_name]=[event.source_name,
                                              time.strftime("%Y %m %d %H %M %S")]
         elif event and event.type == "window:destroy" and event.source:
@@ -210,6 +224,30 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
             window_list.append(window_name)
         return window_list
 
+    def getappstatus(self):
+        """
+        Get responsiveness of the applications seen by window lookups.
+        Unresponsive applications are skipped by lookups and probed
+        again periodically.
+
+        @return: list of [application name, pid, 'responsive' or
+        'unresponsive', slow calls in a row, last call duration in
+        milliseconds]
+        @rtype: list
+        """
+        status=[]
+        for app, health in list(self.app_health.items()):
+            try:
+                name=app.name
+                pid=app.get_process_id()
+            except:
+                name=''
+                pid=-1
+            state=health[1] is None and 'responsive' or 'unresponsive'
+            status.append([name, pid, state, health[0],
+                           int(health[2] * 1000)])
+        return status
+
     def isalive(self):
         """
         Client will use this to verify whether the server instance is alive or not.
@@ -260,15 +298,8 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
 
         @raise LdtpServerException: When command fails
         """
-        os.environ['NO_GAIL']='0'
-        os.environ['NO_AT_BRIDGE']='0'
-        if env:
-            os.environ['GTK_MODULES']='gail:atk-bridge'
-            os.environ['GNOME_ACCESSIBILITY']='1'
-        if lang:
-            os.environ['LANG']=lang
         try:
-            process=subprocess.Popen([cmd]+args, close_fds=True)
+            process=self._spawn(cmd, args, env, lang)
             # Let us wait so that the application launches
             try:
                 time.sleep(int(delay))
@@ -276,10 +307,125 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
                 time.sleep(5)
         except Exception as e:
             raise LdtpServerException(str(e))
-        os.environ['NO_GAIL']='1'
-        os.environ['NO_AT_BRIDGE']='1'
         return process.pid
 
+    def _spawn(self, cmd, args, env, lang):
+        """
+        Start application with accessibility enabled. The environment is
+        built for the child only, the daemon environment is untouched.
+
+        @return: new process
+        @rtype: subprocess.Popen
+        """
+        child_env=dict(os.environ)
+        child_env['NO_GAIL']='0'
+        child_env['NO_AT_BRIDGE']='0'
+        if env:
+            child_env['GTK_MODULES']='gail:atk-bridge'
+            child_env['GNOME_ACCESSIBILITY']='1'
+        if lang:
+            child_env['LANG']=lang
+        process=subprocess.Popen([cmd]+args, close_fds=True, env=child_env)
+        for pid in list(self.launched_apps.keys()):
+            # Forget earlier runs of the same command, once they exited
+            previous=self.launched_apps[pid]
+            if previous[1] == cmd and previous[0].poll() is not None:
+                del self.launched_apps[pid]
+        # A crash of an earlier run is no longer news
+        self.exited_apps[:]=[exited for exited in self.exited_apps
+                             if exited[0] != cmd]
+        self.launched_apps[process.pid]=[process, cmd, set()]
+        return process
+
+    def _window_names(self, waiter):
+        """
+        @return: LDTP window name of each top level found by the waiter,
+        empty string where none appeared
+        @rtype: list
+        """
+        window_names=[]
+        for gui in waiter.top_levels:
+            if gui:
+                abbrev_role, abbrev_name, label_by=self._ldtpize_accessible( \
+                    gui)
+                window_names.append('%s%s' % (abbrev_role, abbrev_name))
+            else:
+                window_names.append('')
+        return window_names
+
+    def launchappwait(self, cmd, args=[], window_name='', delay=30, env=1,
+                      lang="C"):
+        """
+        Launch application and return as soon as its first window appears,
+        instead of sleeping a fixed delay.
+
+        @param cmd: Command line string to execute.
+        @type cmd: string
+        @param args: Arguments to the application
+        @type args: list
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob. Empty to wait for any
+        window of the new process.
+        @type window_name: string
+        @param delay: Wait timeout in seconds
+        @type delay: int
+        @param env: GNOME accessibility environment to be set or not
+        @type env: int
+        @param lang: Application language to be used
+        @type lang: string
+
+        @return: [PID of new process, window name in LDTP format], window
+        name is empty when no window appeared before the timeout
+        @rtype: list
+
+        @raise LdtpServerException: When command fails
+        """
+        return self.launchapps([[cmd, args, window_name]], delay, env,
+                               lang)[0]
+
+    def launchapps(self, apps, delay=30, env=1, lang="C"):
+        """
+        Launch applications together and wait for the first window of
+        each of them in parallel.
+
+        @param apps: Command line string, or [command, arguments,
+        window name] list, per application. See launchappwait.
+        @type apps: list
+        @param delay: Wait timeout in seconds, shared by all applications
+        @type delay: int
+        @param env: GNOME accessibility environment to be set or not
+        @type env: int
+        @param lang: Application language to be used
+        @type lang: string
+
+        @return: [PID, window name in LDTP format] per application, in
+        the given order. Window name is empty when no window appeared
+        before the timeout.
+        @rtype: list
+
+        @raise LdtpServerException: When a command fails
+        """
+        targets=[]
+        for app in apps:
+            if isinstance(app, basestring):
+                app=[app]
+            cmd=app[0]
+            args=len(app) > 1 and app[1] or []
+            if isinstance(args, basestring):
+                args=[args]
+            window_name=len(app) > 2 and app[2] or ''
+            try:
+                process=self._spawn(cmd, args, env, lang)
+            except Exception as e:
+                raise LdtpServerException('%s: %s' % (cmd, e))
+            targets.append((process.pid, window_name))
+        if not targets:
+            return []
+        waiter=AppWindowWaiter(targets, delay, owner=self)
+        waiter.run()
+        return [[pid, window_name] for (pid, _window_name), window_name \
+                    in zip(targets, self._window_names(waiter))]
+
     def poll_events(self):
         """
         Poll for any registered events or window create events
@@ -553,6 +699,39 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         """
         return self.guiexist(window_name, object_name)
 
+    def _window_action(self, window_name, action, match_all=False):
+        """
+        Perform a wnck window action, and wait for wnck to report it
+        done
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob. Empty for all windows.
+        @type window_name: string
+        @param action: Key of waiters.window_actions
+        @type action: string
+        @param match_all: Act on every matching window, not just the first
+        @type match_all: boolean
+
+        @return: number of windows the action took effect on
+        @rtype: integer
+        """
+        if not wnckModule:
+          raise LdtpServerException('Install python wnck module')
+        if not self._window_index:
+          self._window_index=WindowIndex()
+        windows=[w for w in self._window_index.match(window_name)
+                 if self._window_index.can(w, action)]
+        if window_name and not match_all:
+          # If window name specified, act on just the first match
+          windows=windows[:1]
+        elif not window_name and action == 'activate':
+          # Can't activate all windows
+          windows=[]
+        waiter=WindowStateWaiter(self._window_index, windows, action,
+                                 self._window_timeout, owner=self)
+        waiter.run()
+        return len(waiter.done_windows)
+
     def maximizewindow(self, window_name=None):
         """
         Maximize a window using wnck
@@ -564,11 +743,7 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @return: 1 if window maximized, 0 if not.
         @rtype: integer
         """
-        if not wnckModule:
-          raise LdtpServerException('Install python wnck module')
-        waiter=MaximizeWindow(window_name)
-
-        return int(waiter.run())
+        return int(self._window_action(window_name, 'maximize') > 0)
 
     def minimizewindow(self, window_name=None):
         """
@@ -581,11 +756,7 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @return: 1 if window minimized, 0 if not.
         @rtype: integer
         """
-        if not wnckModule:
-          raise LdtpServerException('Install python wnck module')
-        waiter=MinimizeWindow(window_name)
-
-        return int(waiter.run())
+        return int(self._window_action(window_name, 'minimize') > 0)
 
     def unmaximizewindow(self, window_name=None):
         """
@@ -598,11 +769,7 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @return: 1 if window unmaximized, 0 if not.
         @rtype: integer
         """
-        if not wnckModule:
-          raise LdtpServerException('Install python wnck module')
-        waiter=UnmaximizeWindow(window_name)
-
-        return int(waiter.run())
+        return int(self._window_action(window_name, 'unmaximize') > 0)
 
     def unminimizewindow(self, window_name=None):
         """
@@ -615,11 +782,7 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @return: 1 if window unminimized, 0 if not.
         @rtype: integer
         """
-        if not wnckModule:
-          raise LdtpServerException('Install python wnck module')
-        waiter=UnminimizeWindow(window_name)
-
-        return int(waiter.run())
+        return int(self._window_action(window_name, 'unminimize') > 0)
 
     def activatewindow(self, window_name):
         """
@@ -632,11 +795,7 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @return: 1 if window unminimized, 0 if not.
         @rtype: integer
         """
-        if not wnckModule:
-          raise LdtpServerException('Install python wnck module')
-        waiter=ActivateWindow(window_name)
-
-        return int(waiter.run())
+        return int(self._window_action(window_name, 'activate') > 0)
 
     def closewindow(self, window_name=None):
         """
@@ -649,11 +808,20 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @return: 1 if window unminimized, 0 if not.
         @rtype: integer
         """
-        if not wnckModule:
-          raise LdtpServerException('Install python wnck module')
-        waiter=CloseWindow(window_name)
+        return int(self._window_action(window_name, 'close') > 0)
 
-        return int(waiter.run())
+    def closewindows(self, window_name):
+        """
+        Close every matching window in one pass using wnck
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+
+        @return: number of windows closed, 0 if none.
+        @rtype: integer
+        """
+        return self._window_action(window_name, 'close', True)
 
     def guiexist(self, window_name, object_name=''):
         """
@@ -670,9 +838,10 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @rtype: integer
         """
         if object_name:
-            waiter=ObjectExistsWaiter(window_name, object_name, 0)
+            waiter=ObjectExistsWaiter(window_name, object_name, 0,
+                                      owner=self)
         else:
-            waiter=GuiExistsWaiter(window_name, 0)
+            waiter=GuiExistsWaiter(window_name, 0, owner=self)
 
         return int(waiter.run())
 
@@ -680,8 +849,8 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
       """
       Change GUI timeout period, default 30 seconds.
 
-      @param timeout: timeout in seconds
-      @type timeout: integer
+      @param timeout: timeout in seconds, fractions allowed
+      @type timeout: float
 
       @return: 1 on success.
       @rtype: integer
@@ -693,8 +862,8 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
       """
       Change object timeout period, default 5 seconds.
 
-      @param timeout: timeout in seconds
-      @type timeout: integer
+      @param timeout: timeout in seconds, fractions allowed
+      @type timeout: float
 
       @return: 1 on success.
       @rtype: integer
@@ -702,6 +871,33 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
       self._obj_timeout=timeout
       return 1
 
+    def pollceiling(self, ceiling):
+      """
+      Change the longest interval between polls of waits, default 1
+      second. Polling starts at 20 milliseconds and doubles up to it.
+
+      @param ceiling: interval in seconds, fractions allowed
+      @type ceiling: float
+
+      @return: 1 on success.
+      @rtype: integer
+      """
+      if ceiling < Waiter.min_interval:
+          raise LdtpServerException('Invalid poll ceiling %s' % ceiling)
+      Waiter.poll_ceiling=float(ceiling)
+      return 1
+
+    def getwaitstats(self):
+      """
+      Get the most recent waits
+
+      @return: list of [waiter, polls, milliseconds waited, 1 if the
+      condition was met or 0], oldest first
+      @rtype: list
+      """
+      return [[name, polls, elapsed, int(success)] \
+                  for name, polls, elapsed, success in Waiter.history]
+
     def waittillguiexist(self, window_name, object_name='',
                          guiTimeOut=30, state=''):
         """
@@ -721,13 +917,71 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @return: 1 if GUI was found, 0 if not.
         @rtype: integer
         """
+        if object_name and state:
+            return self._wait_for_state(window_name, object_name, state, True,
+                                        guiTimeOut)
         if object_name:
-            waiter=ObjectExistsWaiter(window_name, object_name, guiTimeOut, state)
+            waiter=ObjectExistsWaiter(window_name, object_name, guiTimeOut,
+                                      state, owner=self)
         else:
-            waiter=GuiExistsWaiter(window_name, guiTimeOut)
+            waiter=GuiExistsWaiter(window_name, guiTimeOut, owner=self)
 
         return int(waiter.run())
 
+    def _wait_for_state(self, window_name, object_name, state, present,
+                        guiTimeOut):
+        """
+        Resolve the object and wait for its state-changed events, it is
+        resolved again if the application rebuilds it. If the object
+        doesn't exist yet, poll till it does.
+
+        @return: 1 if the object has, or doesn't have, the state, 0 if not.
+        @rtype: integer
+        """
+        try:
+            if re.search(';', object_name):
+                obj=self._get_menu_hierarchy(window_name, object_name,
+                                             wait=False)
+            else:
+                obj=self._get_object(window_name, object_name, False)
+        except LdtpServerException:
+            obj=None
+        if obj:
+            waiter=StateWaiter(window_name, object_name, obj, state, present,
+                               guiTimeOut, owner=self)
+        elif present:
+            waiter=ObjectExistsWaiter(window_name, object_name, guiTimeOut,
+                                      state, owner=self)
+        else:
+            # Object doesn't exist, so it doesn't have the state either
+            return 1
+        return int(waiter.run())
+
+    def waittillstate(self, window_name, object_name, state, present=1,
+                      guiTimeOut=30):
+        """
+        Wait till an object gets, or loses, a state. Like a button
+        becoming sensitive or a progress dialog no longer busy.
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param object_name: Object name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type object_name: string
+        @param state: State name, like sensitive or busy
+        @type state: string
+        @param present: 1 to wait for the state, 0 to wait for it to go
+        @type present: integer
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: 1 on success, 0 on timeout.
+        @rtype: integer
+        """
+        return self._wait_for_state(window_name, object_name, state, present,
+                                    guiTimeOut)
+
     def waittillguinotexist(self, window_name, object_name='', guiTimeOut=30):
         """
         Wait till a window does not exist.
@@ -746,12 +1000,292 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         """
         if object_name:
             waiter=\
-                ObjectNotExistsWaiter(window_name, object_name, guiTimeOut)
+                ObjectNotExistsWaiter(window_name, object_name, guiTimeOut,
+                                      owner=self)
         else:
-            waiter=GuiNotExistsWaiter(window_name, guiTimeOut)
+            waiter=GuiNotExistsWaiter(window_name, guiTimeOut, owner=self)
+
+        return int(waiter.run())
+
+    def waittillregionstable(self, window_name=None, x=0, y=0, width=None,
+                             height=None, frames=3, interval=0.2,
+                             guiTimeOut=30):
+        """
+        Wait till the whole desktop or given window region stops changing,
+        for animations that go on after the accessibility state settled.
+        Other requests are served while waiting.
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+        @param frames: Consecutive identical captures required
+        @type frames: integer
+        @param interval: Seconds between captures, fractions allowed
+        @type interval: float
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: 1 if the region is stable, 0 if not.
+        @rtype: integer
+
+        @raise LdtpServerException: When the window doesn't exist
+        """
+        if frames < 1:
+            raise LdtpServerException('Invalid frame count %d' % frames)
+        interval=max(0.01, float(interval))
+        capture=lambda: self._capture_pixbuf(window_name, x, y, width, height)
+        # Raises now when the window doesn't exist, instead of failing
+        # every capture till guiTimeOut
+        pb=capture()
+        waiter=RegionStableWaiter(capture, frames, interval, guiTimeOut,
+                                  owner=self)
+        waiter.add_frame(pb)
+        del pb
+
+        return int(waiter.run())
+
+    def waittillidle(self, app_name, quiet_ms=500, guiTimeOut=30):
+        """
+        Wait till an application stops sending children-changed,
+        property-change and state-changed accessibility events for
+        quiet_ms, a replacement for fixed sleeps after launchapp or
+        clicks that rebuild a dialog.
+
+        @param app_name: Application name glob, or window name to look
+        for, either full name, LDTP's name convention, or a Unix glob.
+        @type app_name: string
+        @param quiet_ms: Milliseconds without events
+        @type quiet_ms: integer
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: Seconds waited, 0 if the application didn't go quiet.
+        @rtype: float
+        """
+        if quiet_ms <= 0:
+            raise LdtpServerException('Invalid quiet period %d' % quiet_ms)
+        start=time.time()
+        waiter=IdleWaiter(app_name, quiet_ms, guiTimeOut, owner=self)
+        if waiter.run():
+            return round(time.time() - start, 3)
+        return 0
 
+    def _parse_conditions(self, conditions):
+        """
+        @return: list of (window name, object name, state, exists)
+        @rtype: list
+        """
+        parsed=[]
+        for condition in conditions:
+            if isinstance(condition, basestring):
+                condition=[condition]
+            condition=list(condition) + ['', '', 1][len(condition) - 1:]
+            if len(condition) != 4 or not condition[0]:
+                raise LdtpServerException('Invalid condition %s' % condition)
+            parsed.append(tuple(condition))
+        return parsed
+
+    def waittillany(self, conditions, guiTimeOut=30):
+        """
+        Wait till any of the conditions is met, like which one of several
+        dialogs appears.
+
+        @param conditions: list of [window name, object name, state,
+        exists] where object name and state may be empty, and exists is
+        1 to wait for the window or object and 0 for it to go away.
+        Trailing items can be left out, a window name alone is accepted.
+        @type conditions: list
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: index of the condition met, lowest index when several
+        are, -1 on timeout.
+        @rtype: integer
+        """
+        waiter=ConditionsWaiter(self._parse_conditions(conditions), False,
+                                guiTimeOut, owner=self)
+        waiter.run()
+        return waiter.index
+
+    def waittillall(self, conditions, guiTimeOut=30):
+        """
+        Wait till all the conditions are met at the same time.
+
+        @param conditions: list of conditions, as waittillany
+        @type conditions: list
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: 1 if all the conditions are met, 0 if not.
+        @rtype: integer
+        """
+        waiter=ConditionsWaiter(self._parse_conditions(conditions), True,
+                                guiTimeOut, owner=self)
         return int(waiter.run())
 
+    def _act_and_wait(self, action, conditions, guiTimeOut):
+        """
+        Subscribe to the conditions, perform the action, then wait
+        till any of the conditions is met.
+
+        @return: index of the condition met, -1 on timeout.
+        @rtype: integer
+        """
+        waiter=ConditionsWaiter(self._parse_conditions(conditions), False,
+                                guiTimeOut, owner=self)
+        waiter.run(action)
+        return waiter.index
+
+    def actandwait(self, action, args, conditions, guiTimeOut=30):
+        """
+        Call an LDTP action and wait for its outcome in one call, like
+        a click that opens a dialog. The conditions are watched before
+        the action runs, so an outcome that comes and goes quickly is
+        not missed.
+
+        @param action: LDTP method name, like click or selectmenuitem
+        @type action: string
+        @param args: Arguments of the action
+        @type args: list
+        @param conditions: list of conditions, as waittillany
+        @type conditions: list
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: index of the condition met, -1 on timeout.
+        @rtype: integer
+        """
+        if action.startswith('_') or action.startswith('wait') or \
+                action.endswith('andwait'):
+            raise LdtpServerException('Invalid action %s' % action)
+        method=getattr(self, action, None)
+        if not callable(method):
+            raise LdtpServerException('Unknown action %s' % action)
+        return self._act_and_wait(lambda: method(*args), conditions,
+                                  guiTimeOut)
+
+    def clickandwait(self, window_name, object_name, conditions,
+                     guiTimeOut=30):
+        """
+        Click item and wait for the outcome, see actandwait.
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param object_name: Object name to look for, either full name,
+        LDTP's name convention, or a Unix glob. 
+        @type object_name: string
+        @param conditions: list of conditions, as waittillany
+        @type conditions: list
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: index of the condition met, -1 on timeout.
+        @rtype: integer
+        """
+        return self.actandwait('click', [window_name, object_name],
+                               conditions, guiTimeOut)
+
+    def selectmenuitemandwait(self, window_name, object_name, conditions,
+                              guiTimeOut=30):
+        """
+        Select menu item and wait for the outcome, see actandwait.
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param object_name: Object name to look for, either full name,
+        LDTP's name convention, or a Unix glob. Or menu heirarchy
+        @type object_name: string
+        @param conditions: list of conditions, as waittillany
+        @type conditions: list
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: index of the condition met, -1 on timeout.
+        @rtype: integer
+        """
+        return self.actandwait('selectmenuitem', [window_name, object_name],
+                               conditions, guiTimeOut)
+
+    def enterstringandwait(self, window_name, object_name, data, conditions,
+                           guiTimeOut=30):
+        """
+        Type string and wait for the outcome, see actandwait.
+
+        @param window_name: Window name to type in, either full name,
+        LDTP's name convention, or a Unix glob. Or string to type,
+        with object_name and data empty, as enterstring.
+        @type window_name: string
+        @param object_name: Object name to type in, either full name,
+        LDTP's name convention, or a Unix glob. 
+        @type object_name: string
+        @param data: data to type.
+        @type data: string
+        @param conditions: list of conditions, as waittillany
+        @type conditions: list
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: index of the condition met, -1 on timeout.
+        @rtype: integer
+        """
+        return self.actandwait('enterstring', [window_name, object_name, data],
+                               conditions, guiTimeOut)
+
+    def generatekeyeventandwait(self, data, conditions, guiTimeOut=30):
+        """
+        Generate key event and wait for the outcome, see actandwait.
+
+        @param data: data to type.
+        @type data: string
+        @param conditions: list of conditions, as waittillany
+        @type conditions: list
+        @param guiTimeOut: Wait timeout in seconds
+        @type guiTimeOut: integer
+
+        @return: index of the condition met, -1 on timeout.
+        @rtype: integer
+        """
+        return self.actandwait('generatekeyevent', [data], conditions,
+                               guiTimeOut)
+
+    def runscript(self, script, max_jitter=0):
+        """
+        Run a script of LDTP calls in the daemon, without a round trip
+        per step. Stops at the first failed step.
+
+        @param script: list of steps. A step is [method name, args...]
+        or a dictionary, one of {'call': name, 'args': [...]},
+        {'assert': name, 'args': [...], 'expect': value},
+        {'wait': conditions, 'timeout': seconds} with conditions as
+        waittillany, {'sequence': [steps]} or {'retry': [steps],
+        'times': 3, 'interval': milliseconds}. A dictionary step may
+        add 'delay', milliseconds after the previous step was planned
+        to start, so steps keep a fixed cadence.
+        @type script: list
+        @param max_jitter: Fail a step that starts more than this many
+        milliseconds late, 0 for no limit
+        @type max_jitter: integer
+
+        @return: list of [step path like 2.1, kind, method name, planned
+        start, actual start, duration, 1 if ok else 0, result or error
+        message], one per step performed, times in milliseconds since
+        the script started
+        @rtype: list
+        """
+        script=Script(self, script, max_jitter)
+        script.run()
+        return script.report.rows
+
     def getobjectsize(self, window_name, object_name):
         """
         Get object size
@@ -821,9 +1355,8 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
         @rtype: integer
         """
         try:
-            waiter=\
-                ObjectExistsWaiter(window_name, object_name, guiTimeOut, state)
-            return int(waiter.run())
+            return self._wait_for_state(window_name, object_name, state, True,
+                                        guiTimeOut)
         except:
           if self._ldtp_debug_file:
             with open(self._ldtp_debug_file, "a") as fp:
@@ -1330,7 +1863,7 @@ class Ldtpd(Utils, ComboBox, Table, Menu, PageTabList,
             # this, as it hangs the desktop for the sleep time
             time.sleep(timeout)
             return 1
-        waiter=NullWaiter(1, timeout)
+        waiter=NullWaiter(1, timeout, owner=self)
         return waiter.run()
 
     def getstatusbartext(self, window_name, object_name):
@@ -21,27 +21,61 @@ Headers in this file shall remain intact.
 
 import gc
 import os
+import re
+import stat
+import uuid
+import tempfile
 try:
   # If we have gtk3+ gobject introspection, use that
   from gi.repository import Gtk as gtk, Gdk as gdk
+  from gi.repository import GdkPixbuf, GLib
   gtk3 = True
 except:
   # No gobject introspection, use gtk2
   import gtk
   gtk3 = False
 import pyatspi 
-import tempfile
 from base64 import b64encode
 
 from utils import Utils
+from imaging import numpy, max_cached_baselines, _diff_mask, _diff_result, \
+     _changed_tiles, locatetemplate
 from server_exception import LdtpServerException
 
+# Image formats supported by imagecapture, and the file extension
+# the client should use for each of them
+image_formats = {'png' : 'png', 'jpeg' : 'jpg', 'raw' : 'ppm'}
+mime_types = {'png' : 'image/png', 'jpeg' : 'image/jpeg',
+              'raw' : 'image/x-portable-pixmap'}
+# Screenshots not downloaded are dropped, oldest first,
+# once imagecapturestore holds more than these
+max_captured_images = 10
+# Regions tracked by imagecapturechanges, the least recently
+# used region is forgotten first
+max_previous_frames = 10
+# Same host clients read imagecaptureshm frames from here,
+# /dev/shm is memory backed
+if os.path.isdir('/dev/shm'):
+    shm_dir = '/dev/shm'
+else:
+    shm_dir = tempfile.gettempdir()
+
 class Generic(Utils):
-    def imagecapture(self, window_name = None, x = 0, y = 0,
-                     width = None, height = None):
+    def _capture_pixbuf(self, window_name = None, x = 0, y = 0,
+                        width = None, height = None):
         """
-        Captures screenshot of the whole desktop or given window
-        
+        Capture the whole desktop or given window region as pixbuf
+
+        @return: captured region
+        @rtype: gdk.Pixbuf
+        """
+        return self._capture_region(window_name, x, y, width, height)[0]
+
+    def _capture_region(self, window_name = None, x = 0, y = 0,
+                        width = None, height = None):
+        """
+        Capture the whole desktop or given window region as pixbuf
+
         @param window_name: Window name to look for, either full name,
         LDTP's name convention, or a Unix glob.
         @type window_name: string
@@ -54,9 +88,9 @@ class Generic(Utils):
         @param height: height co-ordinate value
         @type height: int
 
-        @return: screenshot with base64 encoded for the client
-        @rtype: string
-        """	
+        @return: captured region and its desktop x, y co-ordinates
+        @rtype: tuple
+        """
         # Validate the parameters
         # x and y offsets cannot be nagative
         x = max(0, x)
@@ -132,7 +166,6 @@ class Generic(Utils):
             x = x + max(0, bb.x)
             y = y + max(0, bb.y)
 
-        tmpFile = tempfile.mktemp('.png', 'ldtpd_')
         if gtk3:
            window = gdk.get_default_root_window()
            tmp_size = window.get_geometry()
@@ -159,9 +192,6 @@ class Generic(Utils):
                height = min(height, size[1] - y)
            pb = gdk.pixbuf_get_from_window(window, x, y, width,
                                            height)
-           pb.savev(tmpFile, 'png', [], [])
-           del pb
-           gc.collect()
         else:
            window = gtk.gdk.get_default_root_window()
            size = window.get_size()
@@ -188,12 +218,500 @@ class Generic(Utils):
                                       x, y, 0, 0, 
                                       width, 
                                       height)
+        if not pb:
+            raise LdtpServerException('Unable to capture screenshot')
+        return pb, x, y
+
+    def _encode_pixbuf(self, pb, image_format = 'png', quality = -1):
+        """
+        Encode pixbuf in memory
+
+        @param pb: Image to encode
+        @type pb: gdk.Pixbuf
+        @param image_format: png, jpeg or raw (uncompressed RGB, binary PPM)
+        @type image_format: string
+        @param quality: PNG compression level 0 - 9 or JPEG quality 0 - 100,
+        -1 for the gdk-pixbuf default
+        @type quality: int
+
+        @return: encoded image
+        @rtype: string
+        """
+        if image_format == 'jpg':
+            image_format = 'jpeg'
+        if image_format not in image_formats:
+            raise LdtpServerException('Unsupported image format "%s"' % \
+                                          image_format)
+        if image_format == 'raw':
+            return self._pixbuf_to_ppm(pb)
+        options = {}
+        if quality is not None and quality >= 0:
+            if image_format == 'png':
+                options['compression'] = str(min(quality, 9))
+            else:
+                options['quality'] = str(min(quality, 100))
+        if gtk3:
+            success, data = pb.save_to_bufferv(image_format,
+                                               options.keys(),
+                                               options.values())
+            if not success:
+                raise LdtpServerException('Unable to encode screenshot')
+            return str(bytearray(data))
+        chunks = []
+        pb.save_to_callback(lambda buf, chunks: chunks.append(buf),
+                            image_format, options, chunks)
+        return ''.join(chunks)
 
-           if pb:
-              pb.save(tmpFile, 'png')
-              del pb
-              gc.collect()
-        rv = b64encode(open(tmpFile).read())
-        os.remove(tmpFile)
+    def _pixbuf_to_ppm(self, pb):
+        """
+        Raw RGB rows of the pixbuf, with rowstride padding and alpha
+        channel stripped
+
+        @param pb: Image to convert
+        @type pb: gdk.Pixbuf
+
+        @return: binary PPM image
+        @rtype: string
+        """
+        width = pb.get_width()
+        height = pb.get_height()
+        n_channels = pb.get_n_channels()
+        rowstride = pb.get_rowstride()
+        pixels = str(pb.get_pixels())
+        row_size = width * n_channels
+        if rowstride != row_size:
+            pixels = ''.join([pixels[i * rowstride:i * rowstride + row_size] \
+                                  for i in xrange(height)])
+        if n_channels != 3:
+            # Drop alpha, extended slice assignment copies in C
+            src = bytearray(pixels)
+            rgb = bytearray(width * height * 3)
+            for channel in range(3):
+                rgb[channel::3] = src[channel::n_channels]
+            pixels = str(rgb)
+        return 'P6\n%d %d\n255\n' % (width, height) + pixels
+
+    def imagecapture(self, window_name = None, x = 0, y = 0,
+                     width = None, height = None, image_format = 'png',
+                     quality = -1):
+        """
+        Captures screenshot of the whole desktop or given window
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+        @param image_format: png, jpeg or raw (uncompressed RGB, binary PPM)
+        @type image_format: string
+        @param quality: PNG compression level 0 - 9 or JPEG quality 0 - 100,
+        -1 for the gdk-pixbuf default. Low PNG levels are much faster.
+        @type quality: int
+
+        @return: screenshot with base64 encoded for the client
+        @rtype: string
+        """
+        pb = self._capture_pixbuf(window_name, x, y, width, height)
+        rv = b64encode(self._encode_pixbuf(pb, image_format, quality))
+        del pb
+        gc.collect()
         return rv
 
+    def imagecapturestore(self, window_name = None, x = 0, y = 0,
+                          width = None, height = None, image_format = 'png',
+                          quality = -1):
+        """
+        Captures screenshot of the whole desktop or given window and
+        keep it in ldtpd, to be downloaded once with HTTP GET
+        /imagecapture/<token>, without base64 encoding
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+        @param image_format: png, jpeg or raw (uncompressed RGB, binary PPM)
+        @type image_format: string
+        @param quality: PNG compression level 0 - 9 or JPEG quality 0 - 100,
+        -1 for the gdk-pixbuf default.
+        @type quality: int
+
+        @return: token to download the screenshot
+        @rtype: string
+        """
+        if image_format == 'jpg':
+            image_format = 'jpeg'
+        pb = self._capture_pixbuf(window_name, x, y, width, height)
+        data = self._encode_pixbuf(pb, image_format, quality)
+        del pb
+        gc.collect()
+        token = uuid.uuid4().hex
+        self._captured_images[token] = [data, mime_types[image_format]]
+        self._captured_image_tokens.append(token)
+        while len(self._captured_image_tokens) > max_captured_images:
+            old_token = self._captured_image_tokens.pop(0)
+            self._captured_images.pop(old_token, None)
+        return token
+
+    def _pop_captured_image(self, token):
+        """
+        Remove screenshot stored by imagecapturestore
+
+        @param token: token returned by imagecapturestore
+        @type token: string
+
+        @return: [image data, mime type] or None, if token doesn't exist
+        @rtype: list
+        """
+        if token in self._captured_image_tokens:
+            self._captured_image_tokens.remove(token)
+        return self._captured_images.pop(token, None)
+
+    def imagecaptureshm(self, window_name = None, x = 0, y = 0,
+                        width = None, height = None, name = 'capture'):
+        """
+        Captures screenshot of the whole desktop or given window and write
+        the raw pixbuf rows into a shared memory file, for clients on the
+        same host. The file is reused by every capture with the same name.
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+        @param name: Shared memory file name, letters, digits, _ . and -
+        @type name: string
+
+        @return: [file path, width, height, rowstride, channels,
+        RGB / RGBA, length], the file may be longer than the length
+        bytes of this capture
+        @rtype: list
+        """
+        if not re.match(r'^[\w.-]+$', name):
+            raise LdtpServerException('Invalid shared memory name "%s"' % name)
+        pb = self._capture_pixbuf(window_name, x, y, width, height)
+        path = os.path.join(shm_dir, 'ldtp-%d-%s' % (os.getuid(), name))
+        n_channels = pb.get_n_channels()
+        info = [path, pb.get_width(), pb.get_height(), pb.get_rowstride(),
+                n_channels, n_channels == 4 and 'RGBA' or 'RGB']
+        pixels = str(pb.get_pixels())
+        info.append(len(pixels))
+        del pb
+        # The path is predictable, don't follow a planted symlink
+        # or write into someone else's file
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0600)
+        f = os.fdopen(fd, 'r+b')
+        try:
+            st = os.fstat(fd)
+            if st.st_uid != os.getuid() or not stat.S_ISREG(st.st_mode):
+                raise LdtpServerException('%s is not a file owned by ' \
+                                              'ldtpd' % path)
+            # Overwrite in place, recreating the file would leave
+            # clients with the previous frame mapped. Never shrink it,
+            # reading past the end of a mapping raises SIGBUS.
+            f.write(pixels)
+        finally:
+            f.close()
+        gc.collect()
+        return info
+
+    def _subpixbuf(self, pb, x, y, width, height):
+        if gtk3:
+            return pb.new_subpixbuf(x, y, width, height)
+        return pb.subpixbuf(x, y, width, height)
+
+    def imagecapturechanges(self, window_name = None, x = 0, y = 0,
+                            width = None, height = None, tile_size = 64,
+                            image_format = 'png', quality = -1):
+        """
+        Captures screenshot of the whole desktop or given window, and
+        return only the tiles that changed since the previous call for
+        the same region. The first call, or a call after the region size
+        changed, returns the whole region as a single tile.
+
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+        @param tile_size: Tile width and height in pixels
+        @type tile_size: int
+        @param image_format: png, jpeg or raw (uncompressed RGB, binary PPM)
+        @type image_format: string
+        @param quality: PNG compression level 0 - 9 or JPEG quality 0 - 100,
+        -1 for the gdk-pixbuf default.
+        @type quality: int
+
+        @return: list of changed tiles [x, y, width, height, base64 image],
+        co-ordinates relative to the captured region. Empty list when
+        nothing changed.
+        @rtype: list
+        """
+        if tile_size < 1:
+            raise LdtpServerException('Invalid tile size %d' % tile_size)
+        key = '%s-%s-%s-%s-%s' % (window_name, x, y, width, height)
+        pb = self._capture_pixbuf(window_name, x, y, width, height)
+        frame = [pb.get_width(), pb.get_height(), pb.get_rowstride(),
+                 pb.get_n_channels(), str(pb.get_pixels())]
+        previous = self._previous_frames.get(key)
+        if key in self._previous_frame_keys:
+            self._previous_frame_keys.remove(key)
+        self._previous_frame_keys.append(key)
+        self._previous_frames[key] = frame
+        while len(self._previous_frame_keys) > max_previous_frames:
+            self._previous_frames.pop(self._previous_frame_keys.pop(0), None)
+        _width, _height, rowstride, n_channels, pixels = frame
+        if not previous or previous[:4] != frame[:4]:
+            tiles = [(0, 0, _width, _height)]
+        else:
+            tiles = _changed_tiles(previous[4], pixels, _width, _height,
+                                   rowstride, _width * n_channels, tile_size)
+        changes = []
+        for tile in tiles:
+            tile_pb = self._subpixbuf(pb, *tile)
+            changes.append(list(tile) + \
+                               [b64encode(self._encode_pixbuf(tile_pb,
+                                                              image_format,
+                                                              quality))])
+            del tile_pb
+        del pb
+        gc.collect()
+        return changes
+
+    def _pixbuf_array(self, pb):
+        """
+        RGB pixel array of the pixbuf, alpha channel dropped
+
+        @param pb: Image to convert
+        @type pb: gdk.Pixbuf
+
+        @return: array of shape (height, width, 3)
+        @rtype: numpy.ndarray
+        """
+        n_channels = pb.get_n_channels()
+        return numpy.ndarray((pb.get_height(), pb.get_width(), n_channels),
+                             numpy.uint8, str(pb.get_pixels()), 0,
+                             (pb.get_rowstride(), n_channels, 1))[:, :, :3]
+
+    def _load_image_array(self, path):
+        """
+        Decode an image file on the daemon host, reusing it while the
+        file is unchanged
+
+        @param path: Image file name
+        @type path: string
+
+        @return: array of shape (height, width, 3)
+        @rtype: numpy.ndarray
+        """
+        try:
+            key = (path, os.stat(path).st_mtime)
+        except OSError:
+            raise LdtpServerException('Image file %s does not exist' % path)
+        if key in self._image_arrays:
+            self._image_array_keys.remove(key)
+        else:
+            try:
+                if gtk3:
+                    pb = GdkPixbuf.Pixbuf.new_from_file(path)
+                else:
+                    pb = gtk.gdk.pixbuf_new_from_file(path)
+            except Exception:
+                raise LdtpServerException('Unable to load image %s' % path)
+            self._image_arrays[key] = self._pixbuf_array(pb)
+            del pb
+            while len(self._image_array_keys) >= max_cached_baselines:
+                self._image_arrays.pop(self._image_array_keys.pop(0), None)
+        self._image_array_keys.append(key)
+        return self._image_arrays[key]
+
+    def _save_array(self, array, path):
+        """
+        Save RGB pixel array as PNG
+
+        @param array: array of shape (height, width, 3)
+        @type array: numpy.ndarray
+        @param path: Output file name on the daemon host
+        @type path: string
+        """
+        height, width = array.shape[:2]
+        data = numpy.ascontiguousarray(array).tostring()
+        try:
+            if gtk3:
+                pb = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(data),
+                                                     GdkPixbuf.Colorspace.RGB,
+                                                     False, 8, width, height,
+                                                     width * 3)
+                pb.savev(path, 'png', [], [])
+            else:
+                pb = gtk.gdk.pixbuf_new_from_data(data,
+                                                  gtk.gdk.COLORSPACE_RGB,
+                                                  False, 8, width, height,
+                                                  width * 3)
+                pb.save(path, 'png')
+        except Exception:
+            raise LdtpServerException('Unable to save image %s' % path)
+
+    def imagecapturecompare(self, baseline, window_name = None, x = 0,
+                            y = 0, width = None, height = None,
+                            tolerance = 0, mask = None, diff_file = None):
+        """
+        Captures screenshot of the whole desktop or given window and
+        compare it in ldtpd against a baseline image, without sending
+        the screenshot to the client
+
+        @param baseline: Baseline image file name on the daemon host
+        @type baseline: string
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+        @param tolerance: Largest per channel difference still treated as
+        equal, either one value or [R, G, B]
+        @type tolerance: int
+        @param mask: Regions to ignore, list of [x, y, width, height]
+        relative to the captured region, or an image file on the daemon
+        host whose non black pixels are ignored
+        @type mask: list
+        @param diff_file: If given, save the screenshot dimmed, with the
+        differing pixels in red, as PNG on the daemon host
+        @type diff_file: string
+
+        @return: [percentage of differing pixels, bounding box
+        [left, upper, right, lower]], empty bounding box on a match.
+        Pixels outside the common area count as different when the sizes
+        differ.
+        @rtype: list
+        """
+        if numpy is None:
+            raise LdtpServerException('numpy package not installed')
+        expected = self._load_image_array(baseline)
+        if not mask:
+            mask = None
+        elif isinstance(mask, basestring):
+            mask = self._load_image_array(mask)
+        pb = self._capture_pixbuf(window_name, x, y, width, height)
+        current = self._pixbuf_array(pb)
+        del pb
+        try:
+            diff, total = _diff_mask(expected, current, tolerance, mask)
+        except (TypeError, ValueError):
+            raise LdtpServerException('Invalid tolerance or mask')
+        percent, bbox = _diff_result(diff, total)
+        if diff_file:
+            image = numpy.zeros(diff.shape + (3,), numpy.uint8)
+            h, w = current.shape[:2]
+            image[:h, :w] = current >> 1
+            image[diff] = (255, 0, 0)
+            self._save_array(image, diff_file)
+            del image
+        del current, diff
+        gc.collect()
+        return [percent, bbox and list(bbox) or []]
+
+    def imagelocate(self, template, window_name = None, x = 0, y = 0,
+                    width = None, height = None):
+        """
+        Find a template image on the desktop or given window, for canvas
+        and custom widgets without accessible children
+
+        @param template: Template image file name on the daemon host
+        @type template: string
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+
+        @return: [x, y, width, height, score] of the best match in desktop
+        co-ordinates, score 1.0 for a perfect match
+        @rtype: list
+        """
+        if numpy is None:
+            raise LdtpServerException('numpy package not installed')
+        needle = self._load_image_array(template)
+        pb, _x, _y = self._capture_region(window_name, x, y, width, height)
+        haystack = self._pixbuf_array(pb)
+        del pb
+        try:
+            match_x, match_y, score = locatetemplate(haystack, needle)
+        except Exception as e:
+            raise LdtpServerException(str(e))
+        finally:
+            del haystack
+            gc.collect()
+        return [_x + match_x, _y + match_y, needle.shape[1], needle.shape[0],
+                score]
+
+    def imageclick(self, template, window_name = None, x = 0, y = 0,
+                   width = None, height = None, eventType = 'b1c',
+                   min_score = 0.9):
+        """
+        Find a template image, as imagelocate, and generate mouse event
+        on the center of the match
+
+        @param template: Template image file name on the daemon host
+        @type template: string
+        @param window_name: Window name to look for, either full name,
+        LDTP's name convention, or a Unix glob.
+        @type window_name: string
+        @param x: x co-ordinate value
+        @type x: int
+        @param y: y co-ordinate value
+        @type y: int
+        @param width: width co-ordinate value
+        @type width: int
+        @param height: height co-ordinate value
+        @type height: int
+        @param eventType: Mouse event type, as generatemouseevent
+        @type eventType: string
+        @param min_score: Lowest match score accepted
+        @type min_score: float
+
+        @return: 1 on success.
+        @rtype: integer
+        """
+        _x, _y, _width, _height, score = self.imagelocate(template,
+                                                          window_name, x, y,
+                                                          width, height)
+        if score < min_score:
+            raise LdtpServerException('Template %s not found, best score %.3f' \
+                                          % (template, score))
+        return self._mouse_event(_x + _width / 2, _y + _height / 2, eventType)
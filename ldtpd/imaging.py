@@ -0,0 +1,593 @@
+"""
+LDTP v2 image comparison engine.
+
+Kept free of the ldtp client and of gtk, so that both ldtputils and
+the batch comparison workers can import it.
+
+@author: Nagappan Alagappan <nagappan@gmail.com>
+@copyright: Copyright (c) 2009-14 Nagappan Alagappan
+@license: LGPL
+
+http://ldtp.freedesktop.org
+
+This file may be distributed and/or modified under the terms of the GNU Lesser General
+Public License version 2 as published by the Free Software Foundation. This file
+is distributed without any warranty; without even the implied warranty of 
+merchantability or fitness for a particular purpose.
+
+See 'COPYING' in the source distribution for more information.
+
+Headers in this file shall remain intact.
+"""
+
+import os
+import json
+import multiprocessing
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    basestring
+except NameError:
+    # Python 3 clients
+    basestring = str
+
+def _import_pil():
+    try:
+        from PIL import Image, ImageChops
+    except ImportError:
+        try:
+            import Image, ImageChops
+        except ImportError:
+            raise Exception('Python-Imaging package not installed')
+    return Image, ImageChops
+
+def _open_image(image):
+    """
+    Open an image file as RGB
+
+    @param image: File name or already opened PIL image
+    @type image: string
+
+    @return: RGB image
+    @rtype: object
+    """
+    Image, ImageChops = _import_pil()
+    if not hasattr(image, 'mode'):
+        try:
+            image = Image.open(image)
+        except IOError:
+            raise Exception('Input file does not exist')
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+def _mask_array(mask, height, width):
+    """
+    Build the ignore mask, True where pixels must not be compared
+
+    @param mask: List of (x, y, width, height) boxes, or an image file
+    or pixel array whose non black pixels are ignored
+    @type mask: list
+    @param height: Height of the compared area
+    @type height: integer
+    @param width: Width of the compared area
+    @type width: integer
+
+    @return: Boolean array of shape (height, width)
+    @rtype: object
+    """
+    ignore = numpy.zeros((height, width), bool)
+    if isinstance(mask, (list, tuple)):
+        for x, y, w, h in mask:
+            ignore[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)] = True
+        return ignore
+    if hasattr(mask, 'shape'):
+        data = mask
+        if data.ndim == 3:
+            data = data.max(axis=2)
+    else:
+        Image, ImageChops = _import_pil()
+        if not hasattr(mask, 'mode'):
+            try:
+                mask = Image.open(mask)
+            except IOError:
+                raise Exception('Mask file does not exist')
+        data = numpy.asarray(mask.convert('L'))
+    h = min(height, data.shape[0])
+    w = min(width, data.shape[1])
+    ignore[:h, :w] = data[:h, :w] != 0
+    return ignore
+
+def _diff_mask(im1, im2, tolerance=0, mask=None):
+    """
+    Vectorized image comparison, see imagediff
+
+    @param im1: First RGB image or pixel array
+    @type im1: object
+    @param im2: Second RGB image or pixel array
+    @type im2: object
+
+    @return: Boolean array, True where pixels differ, and the number of
+    pixels compared
+    @rtype: tuple
+    """
+    a1 = numpy.asarray(im1)
+    a2 = numpy.asarray(im2)
+    h = min(a1.shape[0], a2.shape[0])
+    w = min(a1.shape[1], a2.shape[1])
+    # Pixels present in only one of the images always differ
+    diff = numpy.ones((max(a1.shape[0], a2.shape[0]),
+                       max(a1.shape[1], a2.shape[1])), bool)
+    a1 = a1[:h, :w]
+    a2 = a2[:h, :w]
+    if not numpy.any(tolerance):
+        changed = a1 != a2
+    else:
+        # Absolute difference without widening the uint8 arrays
+        delta = numpy.maximum(a1, a2)
+        delta -= numpy.minimum(a1, a2)
+        tolerance = numpy.clip(tolerance, 0, 255).astype(numpy.uint8)
+        changed = delta > tolerance
+    # OR the channels, much cheaper than changed.any(axis=2)
+    overlap = diff[:h, :w]
+    numpy.logical_or(changed[..., 0], changed[..., 1], overlap)
+    overlap |= changed[..., 2]
+    total = diff.size
+    if mask is not None:
+        ignore = _mask_array(mask, diff.shape[0], diff.shape[1])
+        diff[ignore] = False
+        total -= int(numpy.count_nonzero(ignore))
+    return diff, total
+
+def _diff_result(diff, total):
+    """
+    @return: Percentage of differing pixels and their bounding box
+    @rtype: tuple
+    """
+    diffcount = int(numpy.count_nonzero(diff))
+    if not diffcount:
+        return 0.0, None
+    rows = numpy.flatnonzero(diff.any(axis=1))
+    cols = numpy.flatnonzero(diff.any(axis=0))
+    bbox = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    return (diffcount * 100.0) / total, bbox
+
+def _imagediff_numpy(im1, im2, tolerance=0, mask=None):
+    return _diff_result(*_diff_mask(im1, im2, tolerance, mask))
+
+def _imagecompare_legacy(imgfile1, imgfile2):
+    Image, ImageChops = _import_pil()
+    try:
+        diffcount = 0.0
+        im1 = Image.open(imgfile1)
+        im2 = Image.open(imgfile2)
+
+        imgcompdiff = ImageChops.difference(im1, im2)
+        diffboundrect = imgcompdiff.getbbox()
+        imgdiffcrop = imgcompdiff.crop(diffboundrect)
+
+        data = imgdiffcrop.getdata()
+
+        seq = []
+        for row in data:
+            seq += list(row)
+
+        for i in range(0, imgdiffcrop.size[0] * imgdiffcrop.size[1] * 3, 3):
+            if seq[i] != 0 or seq[i+1] != 0 or seq[i+2] != 0:
+                diffcount = diffcount + 1.0
+
+        # Like the numpy engine, pixels outside the common area differ
+        # and the percentage is of the area covering both images
+        width = max(im1.size[0], im2.size[0])
+        height = max(im1.size[1], im2.size[1])
+        common_width, common_height = imgcompdiff.size
+        diffcount += width * height - common_width * common_height
+        boxes = [diffboundrect]
+        if width > common_width:
+            boxes.append((common_width, 0, width, height))
+        if height > common_height:
+            boxes.append((0, common_height, width, height))
+        boxes = [box for box in boxes if box]
+        if boxes:
+            diffboundrect = (min([box[0] for box in boxes]),
+                             min([box[1] for box in boxes]),
+                             max([box[2] for box in boxes]),
+                             max([box[3] for box in boxes]))
+
+        diffImgLen = width * height * 1.0
+        diffpercent = (diffcount * 100) / diffImgLen
+        return diffpercent, diffboundrect
+    except IOError:
+        raise Exception('Input file does not exist')
+
+def imagediff(imgfile1, imgfile2, tolerance=0, mask=None):
+    """
+    Compare two images
+
+    @param imgfile1: First image file name
+    @type imgfile1: string
+    @param imgfile2: Second image file name
+    @type imgfile2: string
+    @param tolerance: Largest per channel difference still treated as
+    equal, either one value or an (R, G, B) tuple
+    @type tolerance: integer
+    @param mask: Regions to ignore, a list of (x, y, width, height)
+    boxes or an image file whose non black pixels are ignored
+    @type mask: list
+
+    @return: Percentage of differing pixels and their bounding box
+    (left, upper, right, lower), None when the images match. When the
+    sizes differ, pixels outside the common area count as different.
+    @rtype: tuple
+    """
+    if numpy is None:
+        if tolerance or mask is not None:
+            raise Exception('numpy package not installed')
+        return _imagecompare_legacy(imgfile1, imgfile2)
+    return _imagediff_numpy(_open_image(imgfile1), _open_image(imgfile2),
+                            tolerance, mask)
+
+def _changed_tiles(previous, current, width, height, rowstride, row_size,
+                   tile_size):
+    """
+    Compare two frames of the same geometry tile by tile
+
+    @param previous: Pixels of the previous frame, rows rowstride apart
+    @type previous: string
+    @param current: Pixels of the current frame
+    @type current: string
+    @param row_size: Bytes of pixel data in a row, width * channels
+    @type row_size: integer
+    @param tile_size: Tile width and height in pixels
+    @type tile_size: integer
+
+    @return: list of changed tiles as (x, y, width, height), top to
+    bottom and left to right
+    @rtype: list
+    """
+    channels = row_size // width
+    changed = []
+    if numpy is not None:
+        shape = (height, width, channels)
+        strides = (rowstride, channels, 1)
+        rows = (height + tile_size - 1) // tile_size
+        cols = (width + tile_size - 1) // tile_size
+        # Pad to whole tiles, the frame then reshapes into
+        # (rows, tile, cols, tile, channels) with one any() per tile
+        diff = numpy.zeros((rows * tile_size, cols * tile_size, channels),
+                           bool)
+        numpy.not_equal(numpy.ndarray(shape, numpy.uint8, previous, 0,
+                                      strides),
+                        numpy.ndarray(shape, numpy.uint8, current, 0,
+                                      strides),
+                        diff[:height, :width])
+        dirty = diff.reshape(rows, tile_size, cols, tile_size,
+                             channels).any(axis=(1, 3, 4))
+        for row, col in zip(*numpy.nonzero(dirty)):
+            tile_x = int(col) * tile_size
+            tile_y = int(row) * tile_size
+            changed.append((tile_x, tile_y, min(tile_size, width - tile_x),
+                            min(tile_size, height - tile_y)))
+        return changed
+    tile_bytes = tile_size * channels
+    for tile_y in range(0, height, tile_size):
+        tile_height = min(tile_size, height - tile_y)
+        dirty = set()
+        for row in range(tile_y, tile_y + tile_height):
+            start = row * rowstride
+            # String comparison is a memcmp, unchanged rows
+            # cost one comparison for all the tiles
+            if previous[start:start + row_size] == \
+                    current[start:start + row_size]:
+                continue
+            for offset in range(0, row_size, tile_bytes):
+                if offset in dirty:
+                    continue
+                end = start + min(offset + tile_bytes, row_size)
+                if previous[start + offset:end] != \
+                        current[start + offset:end]:
+                    dirty.add(offset)
+            if len(dirty) * tile_bytes >= row_size:
+                # Every tile in this band already changed
+                break
+        for offset in sorted(dirty):
+            tile_x = offset // channels
+            changed.append((tile_x, tile_y,
+                            min(tile_size, width - tile_x), tile_height))
+    return changed
+
+image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.gif', '.tif',
+                    '.tiff')
+# Decoded baselines kept per worker process, a 1080p RGB frame is ~6MB
+max_cached_baselines = 16
+_baseline_cache = {}
+_baseline_cache_keys = []
+
+def _load_baseline(path):
+    """
+    Decode a baseline image, reusing it while the file is unchanged
+
+    @param path: Baseline image file name
+    @type path: string
+
+    @return: RGB pixels
+    @rtype: object
+    """
+    key = (path, os.stat(path).st_mtime)
+    if key in _baseline_cache:
+        _baseline_cache_keys.remove(key)
+    else:
+        image = _open_image(path)
+        if numpy is not None:
+            image = numpy.asarray(image)
+        _baseline_cache[key] = image
+        while len(_baseline_cache_keys) >= max_cached_baselines:
+            del _baseline_cache[_baseline_cache_keys.pop(0)]
+    _baseline_cache_keys.append(key)
+    return _baseline_cache[key]
+
+def _compare_pair(job):
+    """
+    Worker side of comparebatch
+
+    @param job: Entry from pairsfromdirs or pairsfrommanifest, with
+    tolerance and mask filled in
+    @type job: dict
+
+    @return: job with percent and bbox, or error, added
+    @rtype: dict
+    """
+    result = dict(job)
+    try:
+        if not os.path.exists(job['result']):
+            raise Exception('Result file does not exist')
+        if numpy is None:
+            if job['tolerance'] or job['mask'] is not None:
+                raise Exception('numpy package not installed')
+            percent, bbox = _imagecompare_legacy(job['baseline'],
+                                                 job['result'])
+        else:
+            percent, bbox = _imagediff_numpy(_load_baseline(job['baseline']),
+                                             _open_image(job['result']),
+                                             job['tolerance'], job['mask'])
+        result['percent'] = percent
+        result['bbox'] = bbox and list(bbox)
+    except Exception as e:
+        result['error'] = str(e) or e.__class__.__name__
+    return result
+
+def pairsfromdirs(baseline_dir, result_dir, extensions=image_extensions):
+    """
+    Pair images by their path relative to two directory trees
+
+    @param baseline_dir: Baseline directory tree
+    @type baseline_dir: string
+    @param result_dir: Directory tree holding the new screenshots
+    @type result_dir: string
+    @param extensions: File name extensions treated as images
+    @type extensions: tuple
+
+    @return: List of dict with name, baseline and result keys
+    @rtype: list
+    """
+    pairs = []
+    for dirpath, dirnames, filenames in os.walk(baseline_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(extensions):
+                continue
+            baseline = os.path.join(dirpath, filename)
+            name = os.path.relpath(baseline, baseline_dir)
+            pairs.append({'name' : name, 'baseline' : baseline,
+                          'result' : os.path.join(result_dir, name)})
+    return pairs
+
+def pairsfrommanifest(manifest):
+    """
+    Read image pairs from a JSON lines manifest, one object per line
+    with baseline and result keys and optional name, tolerance and mask.
+    Relative paths, a mask file's included, are relative to the
+    manifest directory.
+
+    @param manifest: Manifest file name
+    @type manifest: string
+
+    @return: List of dict with name, baseline and result keys
+    @rtype: list
+    """
+    pairs = []
+    basedir = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            pair = json.loads(line)
+            for key in ('baseline', 'result'):
+                pair[key] = os.path.join(basedir, pair[key])
+            if isinstance(pair.get('mask'), basestring):
+                # An image file, boxes are lists
+                pair['mask'] = os.path.join(basedir, pair['mask'])
+            pair.setdefault('name', pair['result'])
+            pairs.append(pair)
+    return pairs
+
+def comparebatch(pairs, tolerance=0, mask=None, processes=None):
+    """
+    Compare image pairs in a process pool
+
+    @param pairs: List from pairsfromdirs or pairsfrommanifest
+    @type pairs: list
+    @param tolerance: Default tolerance, see imagediff
+    @type tolerance: integer
+    @param mask: Default ignore mask, see imagediff
+    @type mask: list
+    @param processes: Worker processes, defaults to the number of cores
+    @type processes: integer
+
+    @return: Iterator of result dict, in completion order. Each has
+    percent and bbox keys, or error when the pair could not be compared.
+    @rtype: object
+    """
+    jobs = []
+    for pair in pairs:
+        job = dict(pair)
+        job.setdefault('tolerance', tolerance)
+        job.setdefault('mask', mask)
+        jobs.append(job)
+    # Neighbouring jobs land in the same chunk, so sorting on the
+    # baseline lets each worker reuse its decoded baselines
+    jobs.sort(key=lambda job: job['baseline'])
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _compare_pair(job)
+        return
+    chunksize = max(1, min(16, len(jobs) // (processes * 4)))
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_compare_pair, jobs, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def summarize(results, top=20):
+    """
+    Rank batch results, worst differences first
+
+    @param results: Results from comparebatch
+    @type results: list
+    @param top: Number of worst differences to keep
+    @type top: integer
+
+    @return: dict with compared, identical and failed counts, worst list
+    and errors list
+    @rtype: dict
+    """
+    # comparebatch returns a generator, walked twice below
+    results = list(results)
+    compared = [result for result in results if 'error' not in result]
+    failed = [result for result in results if 'error' in result]
+    compared.sort(key=lambda result: result['percent'], reverse=True)
+    return {'compared' : len(compared),
+            'identical' : len([result for result in compared
+                               if not result['percent']]),
+            'failed' : len(failed),
+            'worst' : [result for result in compared[:top]
+                       if result['percent']],
+            'errors' : failed}
+
+# Template search runs on a downscaled copy until the template is this
+# small, then refines the best coarse candidates at full resolution
+min_template_size = 12
+max_pyramid_factor = 8
+coarse_candidates = 5
+
+def _grayscale(array):
+    """
+    @return: Luminance as float32 array of shape (height, width)
+    @rtype: numpy.ndarray
+    """
+    array = numpy.asarray(array, numpy.float32)
+    return array[..., 0] * 0.299 + array[..., 1] * 0.587 + \
+        array[..., 2] * 0.114
+
+def _downscale(gray, factor):
+    """
+    Average factor x factor pixel blocks
+
+    @return: Downscaled array
+    @rtype: numpy.ndarray
+    """
+    if factor == 1:
+        return gray
+    h = gray.shape[0] // factor
+    w = gray.shape[1] // factor
+    return gray[:h * factor, :w * factor].reshape(h, factor, w,
+                                                 factor).mean(axis=3).mean(axis=1)
+
+def _match_scores(image, template):
+    """
+    Normalized cross correlation of template at every position inside
+    image, numerator through FFT, window sums through integral images
+
+    @return: Scores -1.0 - 1.0, array of shape (image height - template
+    height + 1, image width - template width + 1)
+    @rtype: numpy.ndarray
+    """
+    th, tw = template.shape
+    ih, iw = image.shape
+    template = template - template.mean()
+    template_norm = numpy.sqrt((template ** 2).sum())
+    if not template_norm:
+        raise Exception('Template is a single flat color')
+    shape = (ih, iw)
+    correlation = numpy.fft.irfft2(numpy.fft.rfft2(image, shape) *
+                                   numpy.conj(numpy.fft.rfft2(template, shape)),
+                                   shape)[:ih - th + 1, :iw - tw + 1]
+    image = numpy.asarray(image, numpy.float64)
+    sums = numpy.zeros((ih + 1, iw + 1))
+    squares = numpy.zeros((ih + 1, iw + 1))
+    sums[1:, 1:] = image.cumsum(0).cumsum(1)
+    squares[1:, 1:] = (image ** 2).cumsum(0).cumsum(1)
+    def window(table):
+        return table[th:, tw:] - table[:-th, tw:] - table[th:, :-tw] + \
+            table[:-th, :-tw]
+    variance = window(squares) - window(sums) ** 2 / (th * tw)
+    denominator = numpy.sqrt(numpy.maximum(variance, 0)) * template_norm
+    # Flat image areas can not match a template with detail
+    scores = numpy.where(denominator > 1e-6,
+                         correlation / numpy.maximum(denominator, 1e-6), 0)
+    return numpy.clip(scores, -1.0, 1.0)
+
+def locatetemplate(image, template):
+    """
+    Find where template best matches inside image
+
+    @param image: Pixel array or PIL image to search
+    @type image: object
+    @param template: Pixel array or PIL image to look for
+    @type template: object
+
+    @return: (x, y, score) of the template top left corner, score is the
+    normalized cross correlation, 1.0 for a perfect match
+    @rtype: tuple
+    """
+    image = _grayscale(image)
+    template = _grayscale(template)
+    th, tw = template.shape
+    ih, iw = image.shape
+    if th > ih or tw > iw:
+        raise Exception('Template is larger than the searched image')
+    factor = 1
+    while factor < max_pyramid_factor and \
+            min(th, tw) // (factor * 2) >= min_template_size:
+        factor *= 2
+    if factor == 1:
+        scores = _match_scores(image, template)
+        y, x = numpy.unravel_index(scores.argmax(), scores.shape)
+        return int(x), int(y), float(scores[y, x])
+    coarse = _match_scores(_downscale(image, factor),
+                           _downscale(template, factor))
+    count = min(coarse_candidates, coarse.size)
+    candidates = numpy.argpartition(coarse.ravel(), -count)[-count:]
+    best = (0, 0, -1.0)
+    for index in candidates:
+        cy, cx = numpy.unravel_index(index, coarse.shape)
+        # Refine in a window of one coarse pixel around the candidate
+        left = max(0, cx * factor - factor)
+        top = max(0, cy * factor - factor)
+        right = min(iw, cx * factor + factor + tw)
+        bottom = min(ih, cy * factor + factor + th)
+        scores = _match_scores(image[top:bottom, left:right], template)
+        y, x = numpy.unravel_index(scores.argmax(), scores.shape)
+        if scores[y, x] > best[2]:
+            best = (int(left + x), int(top + y), float(scores[y, x]))
+    return best
@@ -296,6 +296,9 @@ class KeyReleaseAction(AtomicAction):
 # A bit smarter about common interactions.
 
 keystroke_interval = 10
+# Batched key events pause only around shift / capslock toggles,
+# and once every this many keys to let the application catch up
+batch_keys = 32
 mod_key_code_mappings = {
   'GDK_CONTROL_MASK' : 37,
   'GDK_MOD1_MASK' : 64,
@@ -310,7 +313,7 @@ class KeyComboAction(AtomicAction):
   @ivar _key_combo: Name of key combination or single key press-release.
   @type _key_combo: string
   """
-  def __init__(self, key_combo, delta_time=0):    
+  def __init__(self, key_combo, delta_time=0, batch=False):    
     """
     Initialize L{KeyComboAction}.
     
@@ -318,7 +321,10 @@ class KeyComboAction(AtomicAction):
     @type key_combo: string
     @param delta_time: Time to wait before performing step.
     @type delta_time: integer
+    @param batch: Skip the pause before every key, see L{batch_keys}.
+    @type batch: boolean
     """
+    self._batch = batch
     self.key_op = KeyboardOp()
     key_vals = self.key_op.get_keyval_id(key_combo)
     if not key_vals:
@@ -343,6 +349,7 @@ class KeyComboAction(AtomicAction):
     @type modifiers: integer
     """
     interval = 0
+    keys = 0
     for key_val in self._key_combo:
       if key_val.non_print_key == True:
         _type = pyatspi.KEY_PRESS
@@ -356,7 +363,10 @@ class KeyComboAction(AtomicAction):
         # press / release capslck
         pyatspi.Registry.generateKeyboardEvent(66, None, pyatspi.KEY_PRESSRELEASE)
 
-      time.sleep(0.01)
+      if not self._batch or key_val.shift or key_val.capslck or \
+            keys % batch_keys == 0:
+        time.sleep(0.01)
+      keys += 1
       pyatspi.Registry.generateKeyboardEvent(key_val.value, None, _type)
 
       if key_val.shift:
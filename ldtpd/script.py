@@ -0,0 +1,190 @@
+"""
+LDTP v2 step scripts, run by ldtpd without client round trips.
+
+@license: LGPL
+
+http://ldtp.freedesktop.org
+
+This file may be distributed and/or modified under the terms of the GNU Lesser General
+Public License version 2 as published by the Free Software Foundation. This file
+is distributed without any warranty; without even the implied warranty of
+merchantability or fitness for a particular purpose.
+
+See "COPYING" in the source distribution for more information.
+
+Headers in this file shall remain intact.
+"""
+
+from sequence_step import AtomicAction, PauseAction, StepScheduler, \
+    _monotonic
+from server_exception import LdtpServerException
+
+# Scripts may not call these, they would run scripts or waits
+# of their own inside the script
+_reserved_calls = ('runscript',)
+
+class ScriptStep(AtomicAction):
+    """
+    A step of a script, keeps its report row up to date when performed.
+
+    @ivar row: [path, kind, name, planned start, actual start,
+    duration, 1 if ok else 0, result or error message], times in
+    milliseconds since the script started
+    @type row: list
+    """
+    def __init__(self, report, path, kind, name, delta_time, func, *args):
+        AtomicAction.__init__(self, delta_time, func, *args)
+        self._report = report
+        self.row = [path, kind, name, 0, 0, 0, 0, '']
+        self.error = None
+        # Set by StepScheduler
+        self.planned = self.actual = 0
+
+    def __call__(self):
+        # Parent rows come before the rows of their children
+        self._report.rows.append(self.row)
+        self.row[3] = int(round(self.planned))
+        self.row[4] = int(round(self.actual))
+        start = _monotonic()
+        try:
+            late = self.actual - self.planned
+            if self._report.max_jitter and late > self._report.max_jitter:
+                raise LdtpServerException('Started %d ms late' % late)
+            result = self._func(*self._args)
+            self.row[6] = 1
+            if result is not None:
+                # None can't be sent over XML-RPC
+                self.row[7] = result
+        except LdtpServerException as e:
+            self.error = self.row[7] = e.faultString
+        except Exception as e:
+            self.error = self.row[7] = '%s' % e
+        self.row[5] = int((_monotonic() - start) * 1000)
+        self.stepDone()
+
+class ScriptReport(object):
+    """
+    Rows of the steps performed, in the order they started
+
+    @ivar max_jitter: Milliseconds a step may start late, 0 for no limit
+    @type max_jitter: integer
+    """
+    def __init__(self, max_jitter = 0):
+        self.start = _monotonic()
+        self.max_jitter = max_jitter
+        self.rows = []
+
+class Script(object):
+    """
+    Compiles a script into L{ScriptStep}, the calls are made on owner.
+
+    A script is a list of steps. A step is a list of an LDTP method
+    name and its arguments, or a dictionary, one of:
+      - {'call' : name, 'args' : [...]}
+      - {'assert' : name, 'args' : [...], 'expect' : value}, fails
+        unless the call returns value, a true value without expect
+      - {'wait' : conditions, 'timeout' : seconds}, conditions as
+        waittillany, fails on timeout
+      - {'sequence' : [steps]}
+      - {'retry' : [steps], 'times' : 3, 'interval' : milliseconds},
+        runs the steps again while one fails, up to times attempts
+    A dictionary step may add 'delay', milliseconds after the previous
+    step was planned to start, not after it ended.
+    """
+    def __init__(self, owner, steps, max_jitter = 0):
+        self._owner = owner
+        self._steps = steps
+        self.report = ScriptReport(max_jitter)
+
+    def run(self):
+        """
+        @return: True if every step passed
+        @rtype: boolean
+        """
+        self.report.start = _monotonic()
+        return self._scheduler(self._compile(self._steps, '')).run()
+
+    def _scheduler(self, steps):
+        # Nested sequences report times since the script started too
+        return StepScheduler(steps, self.report.start)
+
+    def _compile(self, steps, prefix):
+        if not isinstance(steps, list):
+            raise LdtpServerException('Script steps must be a list')
+        return [self._compile_step(step, '%s%d' % (prefix, index + 1))
+                for index, step in enumerate(steps)]
+
+    def _method(self, name):
+        if not isinstance(name, basestring) or name.startswith('_') or \
+                name in _reserved_calls:
+            raise LdtpServerException('Invalid script call %s' % name)
+        method = getattr(self._owner, name, None)
+        if not callable(method):
+            raise LdtpServerException('Unknown script call %s' % name)
+        return method
+
+    def _compile_step(self, step, path):
+        if isinstance(step, list):
+            if not step:
+                raise LdtpServerException('Empty script step %s' % path)
+            step = {'call' : step[0], 'args' : step[1:]}
+        if not isinstance(step, dict):
+            raise LdtpServerException('Invalid script step %s' % path)
+        delay = int(step.get('delay', 0))
+        args = step.get('args', [])
+        if 'call' in step:
+            return ScriptStep(self.report, path, 'call', step['call'], delay,
+                              self._method(step['call']), *args)
+        if 'assert' in step:
+            return ScriptStep(self.report, path, 'assert', step['assert'],
+                              delay, self._assert,
+                              self._method(step['assert']), args,
+                              step.get('expect'), 'expect' in step)
+        if 'wait' in step:
+            return ScriptStep(self.report, path, 'wait', 'waittillany', delay,
+                              self._wait, step['wait'],
+                              step.get('timeout', 30))
+        if 'sequence' in step:
+            # Check the whole script before running any of it
+            self._compile(step['sequence'], path + '.')
+            return ScriptStep(self.report, path, 'sequence', '', delay,
+                              self._sequence, step['sequence'], path + '.')
+        if 'retry' in step:
+            self._compile(step['retry'], path + '.')
+            return ScriptStep(self.report, path, 'retry', '', delay,
+                              self._retry, step['retry'], path + '.',
+                              max(int(step.get('times', 3)), 1),
+                              int(step.get('interval', 0)))
+        raise LdtpServerException('Invalid script step %s' % path)
+
+    def _assert(self, method, args, expect, has_expect):
+        result = method(*args)
+        if (has_expect and result != expect) or \
+                (not has_expect and not result):
+            raise LdtpServerException('Assertion failed, got %s' % result)
+        return result
+
+    def _wait(self, conditions, timeout):
+        index = self._owner.waittillany(conditions, timeout)
+        if index == -1:
+            raise LdtpServerException('Wait timed out')
+        return index
+
+    def _sequence(self, steps, prefix):
+        runner = self._scheduler(self._compile(steps, prefix))
+        if not runner.run():
+            raise LdtpServerException('Step %s failed' % \
+                                          runner.failed.row[0])
+        return 1
+
+    def _retry(self, steps, prefix, times, interval):
+        for attempt in range(1, times + 1):
+            # Steps are done once performed, compile them afresh
+            compiled = self._compile(steps, prefix)
+            if attempt > 1 and interval:
+                compiled.insert(0, PauseAction(interval))
+            runner = self._scheduler(compiled)
+            if runner.run():
+                return attempt
+        raise LdtpServerException('Step %s failed %d times' % \
+                                      (runner.failed.row[0], times))
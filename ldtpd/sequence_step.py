@@ -17,12 +17,26 @@ See "COPYING" in the source distribution for more information.
 Headers in this file shall remain intact.
 '''
 
-import pyatspi, sys
+import pyatspi, sys, time
 try:
   from gi.repository import GObject as gobject
 except:
   import gobject
 
+try:
+  _monotonic = time.monotonic
+except AttributeError:
+  try:
+    from gi.repository import GLib
+    _monotonic = lambda: GLib.get_monotonic_time() / 1000000.0
+  except:
+    # No monotonic clock, wall clock jumps show up as jitter
+    _monotonic = time.time
+
+# Timers fire late by a millisecond or two, wake up this many
+# milliseconds early and sleep the rest
+wake_early = 2
+
 class SequenceStep(gobject.GObject):
   '''
   Base class for all sequence steps in a Macaroon sequence. Emits a "done" 
@@ -171,3 +185,89 @@ class CallableAction(AtomicAction):
     @type _kwargs: dictionary
     '''
     AtomicAction.__init__(self, 0, func, *args, **kwargs)
+
+class StepScheduler(object):
+  '''
+  Performs a chain of L{SequenceStep}, each delta_time milliseconds after
+  the previous one was planned, not after it was done. A late step does
+  not delay the ones after it, so the chain keeps its cadence. A step is
+  performed once the previous one is done, steps with a true error
+  attribute end the chain.
+
+  @ivar timings: [planned, actual] start of every step performed, in
+  milliseconds since origin
+  @type timings: list
+  @ivar failed: Step that ended the chain, None if all passed
+  @type failed: L{SequenceStep}
+  '''
+  def __init__(self, steps, origin=None):
+    '''
+    Initialize L{StepScheduler}.
+
+    @param steps: Steps to perform, in order.
+    @type steps: list
+    @param origin: Monotonic time timings are relative to, the time
+    L{run} is called by default.
+    @type origin: float
+    '''
+    self._steps = steps
+    self._origin = origin
+    self._index = 0
+    self._loop = None
+    self._planned = None
+    self.timings = []
+    self.failed = None
+
+  def run(self):
+    '''
+    Perform the steps, in a nested main loop.
+
+    @return: True if no step failed
+    @rtype: boolean
+    '''
+    self._planned = _monotonic()
+    if self._origin is None:
+      self._origin = self._planned
+    if self._steps:
+      self._loop = gobject.MainLoop()
+      self._next()
+      self._loop.run()
+    return self.failed is None
+
+  def jitter(self):
+    '''
+    @return: mean and maximum of how late the steps started, in
+    milliseconds
+    @rtype: list
+    '''
+    if not self.timings:
+      return [0, 0]
+    late = [actual - planned for planned, actual in self.timings]
+    return [sum(late) / len(late), max(late)]
+
+  def _next(self):
+    if self.failed or self._index >= len(self._steps):
+      self._loop.quit()
+      return
+    step = self._steps[self._index]
+    self._index += 1
+    step.connect('done', self._stepDone)
+    # From the previous plan, not from now, so lateness doesn't add up
+    self._planned += step.delta_time / 1000.0
+    delay = (self._planned - _monotonic()) * 1000 - wake_early
+    gobject.timeout_add(max(int(delay), 0), self._perform, step)
+
+  def _perform(self, step):
+    remaining = self._planned - _monotonic()
+    if remaining > 0:
+      time.sleep(remaining)
+    step.planned = (self._planned - self._origin) * 1000
+    step.actual = (_monotonic() - self._origin) * 1000
+    self.timings.append([step.planned, step.actual])
+    step()
+    return False
+
+  def _stepDone(self, step):
+    if getattr(step, 'error', None):
+      self.failed = step
+    self._next()
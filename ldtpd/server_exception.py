@@ -20,7 +20,16 @@ Headers in this file shall remain intact.
 from twisted.web import xmlrpc
 
 ERROR_CODE = 123
+APP_EXITED_ERROR_CODE = 124
 
 class LdtpServerException(xmlrpc.Fault):
     def __init__(self, message):
         xmlrpc.Fault.__init__(self, ERROR_CODE, message)
+
+class LdtpAppExitedException(LdtpServerException):
+    """
+    Application launched by ldtpd exited while its window was expected
+    """
+    def __init__(self, message, exit_status):
+        xmlrpc.Fault.__init__(self, APP_EXITED_ERROR_CODE, message)
+        self.exit_status = exit_status
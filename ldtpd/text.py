@@ -20,6 +20,7 @@ Headers in this file shall remain intact.
 """
 
 import re
+import time
 import pyatspi 
 from utils import Utils
 from fnmatch import translate as glob_trans
@@ -76,7 +77,70 @@ class Text(Utils):
 
         return 1
 
-    def enterstring(self, window_name, object_name='', data=''):
+    def _text_segments(self, text):
+        """
+        Split enterstring text into literal runs and key runs. Keys
+        named like <ctrl> stay held till the next character, so that
+        character goes with the key run.
+
+        @param text: Text to type
+        @type text: string
+
+        @return: list of [is key run, text]
+        @rtype: list
+        """
+        segments=[]
+        for index, part in enumerate(re.split('(<[^<>]*>)', text)):
+            if not part:
+                continue
+            if index % 2:
+                if segments and segments[-1][0]:
+                    segments[-1][1]+=part
+                else:
+                    segments.append([True, part])
+                continue
+            if segments and segments[-1][0]:
+                segments[-1][1]+=part[0]
+                part=part[1:]
+            if part:
+                segments.append([False, part])
+        return segments
+
+    def _insert_at_caret(self, obj, text):
+        """
+        Insert text at the caret through EditableText, and move the
+        caret past it, as typing would.
+
+        @param obj: Accessible object with focus
+        @type obj: object
+        @param text: Text to insert
+        @type text: string
+
+        @return: True if inserted, False if the object can't insert text
+        @rtype: boolean
+        """
+        try:
+            texti=obj.queryText()
+            editable=obj.queryEditableText()
+            offset=texti.caretOffset
+            if offset < 0:
+                offset=texti.characterCount
+            data=text.encode('utf-8')
+            # Length of the encoded bytes, not of the characters
+            if not editable.insertText(offset, data, len(data)):
+                return False
+        except Exception:
+            # Not editable, or an AT-SPI error, type the keys instead
+            return False
+        try:
+            # The caret moves by characters
+            texti.setCaretOffset(offset + len(text))
+        except Exception:
+            # Inserted already, typing it again would duplicate it
+            pass
+        return True
+
+    def enterstring(self, window_name, object_name='', data='', fast=0):
         """
         Type string sequence.
         
@@ -88,15 +152,22 @@ class Text(Utils):
         @type object_name: string
         @param data: data to type.
         @type data: string
+        @param fast: 1 to insert text straight into the object where it
+        supports editable text, and send the rest as key events without
+        a pause before every key.
+        @type fast: integer
 
         @return: 1 on success.
         @rtype: integer
         """
+        obj=None
         if object_name:
             obj=self._get_object(window_name, object_name,
                                  obj_type=['combo_box', 'text', 'entry',
                                            'paragraph', 'password_text', 'editbar'])
             self._grab_focus(obj)
+            if fast and obj.getRole() == pyatspi.ROLE_COMBO_BOX:
+                obj=self._get_child_object_type(obj, pyatspi.ROLE_TEXT)
         if data:
             for gui in self._list_guis():
                 if self._match_name_to_acc(window_name, gui):
@@ -105,8 +176,22 @@ class Text(Utils):
         else:
             text=window_name # TODO: Major hack, this is a bad API choice
 
-        key_combo_action=KeyComboAction(text)
-        key_combo_action()
+        if not fast:
+            key_combo_action=KeyComboAction(text)
+            key_combo_action()
+            return 1
+
+        for is_key, segment in self._text_segments(text):
+            if not is_key and obj and self._insert_at_caret(obj, segment):
+                continue
+            if not is_key:
+                # Not editable, don't try again for every segment
+                obj=None
+            key_combo_action=KeyComboAction(segment, batch=True)
+            key_combo_action()
+            if obj:
+                # Let the keys move the caret before inserting after it
+                time.sleep(0.05)
 
         return 1
 
@@ -32,7 +32,7 @@ import logging.handlers
 from re import match as re_match
 from constants import abbreviated_roles
 from fnmatch import translate as glob_trans
-from server_exception import LdtpServerException
+from server_exception import LdtpServerException, LdtpAppExitedException
 
 importStatGrab = False
 try:
@@ -41,6 +41,18 @@ try:
 except ImportError:
     pass
 
+# AT-SPI call timeout in milliseconds, instead of the long D-Bus default,
+# so a hung application fails calls quickly (pyatspi2 only)
+try:
+    app_call_timeout = int(os.environ.get('LDTP_APP_TIMEOUT', 3000))
+except ValueError:
+    app_call_timeout = 3000
+# An application answering this slowly this many times in a row is
+# skipped by window lookups, and probed again after recheck seconds
+app_slow_seconds = 1.0
+app_slow_strikes = 3
+app_recheck_seconds = 10
+
 class LdtpCustomLog(logging.Handler):
     """
     Custom LDTP log, inherit logging.Handler and implement
@@ -156,6 +168,16 @@ class ProcessStats(threading.Thread):
 
 class Utils:
     cached_apps = None
+    # Application handle: [slow calls in a row, time marked unresponsive
+    # or None, duration of the last call in seconds]
+    app_health = {}
+    # Applications started by launchapp, pid: [process, command,
+    # LDTP names of the windows seen from it]
+    launched_apps = {}
+    # Launched applications that exited with a non zero status, kept
+    # till a lookup of one of their windows reports it:
+    # [command, pid, exit status, LDTP names of their windows]
+    exited_apps = []
     def __init__(self):
         lazy_load = True
         self._states = {}
@@ -179,6 +201,12 @@ class Utils:
         # Initialize atspi2 version to False
         self._atspi2_ver = False
         if Utils.cached_apps is None:
+            try:
+                from gi.repository import Atspi
+                Atspi.set_timeout(app_call_timeout, -1)
+            except:
+                # Not available with pyatspi 1.x
+                pass
             pyatspi.Registry.registerEventListener(
                 self._on_window_event, 'window')
             # Above window event doesn't get called for
@@ -353,22 +381,92 @@ class Utils:
         """
         List all the windows that are currently open
         """
+        for app, gui in self._list_app_guis():
+            yield gui
+
+    def _list_app_guis(self):
+        """
+        List all the windows that are currently open, with their
+        application handle
+        """
         self._atspi2_workaround()
         for app in self.cached_apps:
             if not app or not app[0]: continue
+            if not self._app_responsive(app[0]):
+                # Don't let a hung application stall every lookup
+                continue
+            start = time.time()
             try:
                 # application handle will be in app[0]
                 # app[1] will hold, whether remap should be done or not
-                for gui in app[0]:
-                    if not gui: continue
-                    yield gui
+                guis = [gui for gui in app[0]]
             except LookupError:
                 # If the window doesn't exist, remove from the cached list
                 self.cached_apps.remove(app)
-            except:
+                self.app_health.pop(app[0], None)
+                continue
+            except Exception as e:
+                if self._is_call_timeout(e):
+                    self._record_app_call(app[0], time.time() - start, True)
+                    continue
                 # In at-spi2 gi._glib.GError exception is thrown
                 # If the window doesn't exist, remove from the cached list
                 self.cached_apps.remove(app)
+                self.app_health.pop(app[0], None)
+                continue
+            self._record_app_call(app[0], time.time() - start)
+            for gui in guis:
+                if not gui: continue
+                if not self._app_responsive(app[0]):
+                    # Went unresponsive while its windows were queried
+                    break
+                yield app[0], gui
+
+    def _is_call_timeout(self, e):
+        """
+        @param e: Exception raised by an AT-SPI call
+        @type e: Exception
+
+        @return: whether the call timed out, see app_call_timeout
+        @rtype: boolean
+        """
+        return 'timeout' in str(e).lower() or 'NoReply' in str(e)
+
+    def _app_responsive(self, app):
+        """
+        Whether window lookups should query the application, unresponsive
+        applications are probed again every app_recheck_seconds
+
+        @param app: application handle
+        @type app: object
+
+        @rtype: boolean
+        """
+        health = self.app_health.get(app)
+        if not health or health[1] is None:
+            return True
+        return time.time() - health[1] >= app_recheck_seconds
+
+    def _record_app_call(self, app, seconds, timed_out = False):
+        """
+        Update application health with the duration of an AT-SPI call
+
+        @param app: application handle
+        @type app: object
+        @param seconds: call duration
+        @type seconds: float
+        @param timed_out: call failed with timeout
+        @type timed_out: boolean
+        """
+        health = self.app_health.setdefault(app, [0, None, 0.0])
+        health[2] = seconds
+        if timed_out or seconds >= app_slow_seconds:
+            health[0] += 1
+            if health[0] >= app_slow_strikes:
+                health[1] = time.time()
+        else:
+            health[0] = 0
+            health[1] = None
 
     def _ldtpize_accessible(self, acc):
         """
@@ -754,10 +852,23 @@ class Utils:
             _parent = abbrev_name
         else:
             _parent = ''
+        app = gui.parent
+        if app and not self._app_responsive(app):
+            raise LdtpServerException('Application of window "%s" is not ' \
+                                          'responding' % window_name)
+        start = time.time()
         try:
             self._populate_appmap(gui, _parent, gui.getIndexInParent())
         except LookupError:
             raise LdtpServerException("Unable to find window/object")
+        except Exception as e:
+            if app and self._is_call_timeout(e):
+                # Big windows take long to walk, count only timeouts
+                self._record_app_call(app, time.time() - start, True)
+                raise LdtpServerException('Application of window "%s" ' \
+                                              'is not responding' % \
+                                              window_name)
+            raise
         self._appmap[window_name] = self.ldtpized_list
         return self.ldtpized_list
 
@@ -829,22 +940,122 @@ class Utils:
 
         @param window_name: window name, as provided by the caller
         @type window_name: string
+        @param wait: wait up to guitimeout seconds for the window
+        @type wait: boolean
 
         @return: window handle, window name in appmap format
         @rtype: object, string
         """
-        if wait:
-            retry=self._gui_timeout
-        else:
-            retry=1
-        for i in range(retry):
-            gui, name = self._internal_get_window_handle(window_name)
-            if gui:
-                return gui, name
-            if wait:
-                time.sleep(1)
+        gui, name = self._internal_get_window_handle(window_name)
+        if not gui and wait and self._gui_timeout > 0:
+            def lookup():
+                self._check_app_exited(window_name)
+                gui, name = self._internal_get_window_handle(window_name)
+                return gui and (gui, name)
+            # Wake up as soon as a window shows up, instead of
+            # retrying every second
+            gui, name = self._wait_for(lookup, self._gui_timeout,
+                                       ['window:create', 'window:activate']) \
+                                       or (None, None)
+        if gui:
+            self._note_app_window(gui, name)
+            return gui, name
         return None, None
 
+    def _wait_for(self, callback, timeout, events, app = None):
+        """
+        Wait till callback returns a true value, calling it again when
+        one of the events arrive
+
+        @param callback: lookup to retry
+        @type callback: function
+        @param timeout: timeout in seconds, fractions allowed
+        @type timeout: float
+        @param events: AT-SPI events that may change the result
+        @type events: list
+        @param app: only events of this application handle count
+        @type app: object
+
+        @return: callback result, None on timeout. Inside a running
+        waiter, callback is tried once instead.
+        @rtype: object
+        """
+        # waiters import Utils, import on use
+        from waiters import CallbackWaiter, Waiter
+        if Waiter.loops:
+            # Called from a waiter's poll or event callback. A nested
+            # loop would outlive the waiter's deadline and let other
+            # requests change the appmaps mid lookup, look up once.
+            return callback() or None
+        waiter = CallbackWaiter(callback, timeout, events, app,
+                                owner = self)
+        if waiter.run():
+            return waiter.result
+        return None
+
+    def _note_app_window(self, gui, window_name):
+        """
+        Remember the window name, if it belongs to a launched application
+
+        @param gui: window handle
+        @type gui: object
+        @param window_name: window name in LDTP format
+        @type window_name: string
+        """
+        if not self.launched_apps:
+            return
+        try:
+            pid = gui.getApplication().get_process_id()
+        except:
+            # get_process_id exist only in pyatspi2
+            return
+        self._reap_launched_apps()
+        if pid in self.launched_apps:
+            self.launched_apps[pid][2].add(window_name)
+
+    def _reap_launched_apps(self):
+        """
+        Move launched applications that exited out of launched_apps, as
+        their pid may be reused. Non zero exits go to exited_apps.
+        """
+        for pid, (process, cmd, window_names) in \
+                list(self.launched_apps.items()):
+            exit_status = process.poll()
+            if exit_status is None:
+                continue
+            del self.launched_apps[pid]
+            # A zero status is a normal exit, like a single instance
+            # application handing over to its running instance
+            if exit_status != 0 and window_names:
+                self.exited_apps.append([cmd, pid, exit_status,
+                                         window_names])
+
+    def _check_app_exited(self, window_name):
+        """
+        Fail fast when the window belongs to a launched application
+        that has crashed. The crash is reported once, by the first
+        lookup of one of its windows.
+
+        @param window_name: window name, as provided by the caller
+        @type window_name: string
+
+        @raise LdtpAppExitedException: When the application exited with
+        a non zero status or was killed by a signal
+        """
+        self._reap_launched_apps()
+        for exited in list(self.exited_apps):
+            cmd, pid, exit_status, window_names = exited
+            for name in window_names:
+                if window_name == name or \
+                        self._glob_match(window_name, name) or \
+                        self._glob_match(re.sub(' ', '', window_name),
+                                         re.sub(' ', '', name)):
+                    self.exited_apps.remove(exited)
+                    raise LdtpAppExitedException(
+                        '%s (pid %d) exited with status %d, window "%s" ' \
+                            'is gone' % (cmd, pid, exit_status, window_name),
+                        exit_status)
+
     def _internal_get_window_handle(self, window_name):
         """
         Get internal window handle of given window name
@@ -858,10 +1069,18 @@ class Utils:
         window_list = []
         window_type = {}
 
-        for gui in self._list_guis():
+        for app, gui in self._list_app_guis():
             if not gui:
                 continue
-            obj_name = self._ldtpize_accessible(gui)
+            start = time.time()
+            try:
+                obj_name = self._ldtpize_accessible(gui)
+            except Exception as e:
+                if not self._is_call_timeout(e):
+                    raise
+                self._record_app_call(app, time.time() - start, True)
+                continue
+            self._record_app_call(app, time.time() - start)
             if obj_name[1] == '':
                 # If label / label_by is empty string
                 # use index
@@ -931,17 +1150,33 @@ class Utils:
         if not _window_handle:
             raise LdtpServerException('Unable to find window "%s"' % \
                                               window_name)
-        if wait:
-            retry=self._obj_timeout
-        else:
-            retry=1
-        for i in range(retry):
-            obj = self._internal_get_object(_window_handle, _window_name,
-                                            obj_name, obj_type)
+        obj = self._internal_get_object(_window_handle, _window_name,
+                                        obj_name, obj_type)
+        if obj:
+            return obj
+        if wait and self._obj_timeout > 0:
+            def lookup():
+                self._check_app_exited(_window_name)
+                # One appmap rebuild per retry, _internal_get_object
+                # then finds the object in the fresh appmap
+                appmap = self._appmap_pairs(_window_handle, _window_name,
+                                            force_remap = True)
+                if not self._get_object_in_window(appmap, obj_name,
+                                                  obj_type):
+                    return None
+                return self._internal_get_object(_window_handle,
+                                                 _window_name, obj_name,
+                                                 obj_type)
+            try:
+                app = _window_handle.getApplication()
+            except:
+                app = None
+            obj = self._wait_for(lookup, self._obj_timeout,
+                                 ['object:children-changed',
+                                  'object:property-change:accessible-name'],
+                                 app)
             if obj:
                 return obj
-            if wait:
-                time.sleep(1)
         raise LdtpServerException(
             'Unable to find object name "%s" in application map' % obj_name)
 
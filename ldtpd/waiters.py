@@ -21,8 +21,10 @@ Headers in this file shall remain intact.
 
 wnckModule = False
 from utils import Utils
+from server_exception import LdtpAppExitedException
 import re
 import time
+import zlib
 try:
   # If we have gtk3+ gobject introspection, use that
   from gi.repository import Wnck as wnck
@@ -52,38 +54,93 @@ if not gtk3:
        # Required for SLED11
       _main_loop = gobject.MainLoop()
 
-class Waiter(Utils):
+# Waits kept for getwaitstats, most recent last
+max_wait_history = 100
+
+class Waiter(object):
     events = []
-    def __init__(self, timeout):
-        Utils.__init__(self)
+    # Polling starts every min_interval seconds and backs off
+    # exponentially up to poll_ceiling, set by pollceiling
+    min_interval = 0.02
+    poll_ceiling = 1.0
+    # [waiter, polls, milliseconds waited, success] of the last waits
+    history = []
+    # Waiter main loops running, lookups don't nest waits inside them
+    loops = 0
+    def __init__(self, timeout, owner = None):
+        # Borrow the daemon's appmaps, state tables and settings,
+        # instead of building fresh ones for every wait
+        if owner is None:
+            owner = Utils()
+        self._owner = owner
         self.timer = None
         self.timeout = timeout
-        self.timeout_seconds = 1
-
-    def run(self):
+        # Fixed polling interval in seconds, None to back off
+        self.timeout_seconds = None
+        # Window waited for, give up if its application exits
+        self._app_window = None
+        self._app_exited = None
+        self._timer = None
+        self._soon = False
+
+    def run(self, action = None):
+        """
+        @param action: Callable performed once the event listeners are
+        registered, so no event it causes is missed
+        @type action: callable
+        """
         self.success = False
         self._timeout_count = 1
+        self._interval = None
+        self._start = time.time()
+        self._deadline = self._start + self.timeout
+        listening = False
 
-        try:
-          self.poll()
-        except:
-          pass
-
-        if self.success or self.timeout == 0:
+        if action:
+          if self.events:
+            pyatspi.Registry.registerEventListener(
+              self._event_cb, *self.events)
+            listening = True
+          try:
+            action()
+          except:
+            if listening:
+              pyatspi.Registry.deregisterEventListener(
+                self._event_cb, *self.events)
+            raise
+
+        if not self.success:
+          try:
+            self.poll()
+          except:
+            pass
+
+        if self._app_exited or self.success or self.timeout == 0:
           # Return the current state on success
           # or timeout is 0
+          # Events during the action may have scheduled a poll
+          self._cancel_timer()
+          if listening:
+            pyatspi.Registry.deregisterEventListener(
+              self._event_cb, *self.events)
+          self._record()
+          if self._app_exited:
+            raise self._app_exited
           return self.success
 
         try:
-          gobject.timeout_add_seconds(self.timeout_seconds,
-                                      self._timeout_cb)
-          if self.events:
+          self._schedule(self._next_interval())
+          if self.events and not listening:
             pyatspi.Registry.registerEventListener(
               self._event_cb, *self.events)
-          if _main_loop:
-            _main_loop.run()
-          else:
-            gtk.main()
+          Waiter.loops += 1
+          try:
+            if _main_loop:
+              _main_loop.run()
+            else:
+              gtk.main()
+          finally:
+            Waiter.loops -= 1
           if self.events:
             pyatspi.Registry.deregisterEventListener(
               self._event_cb, *self.events)
@@ -93,14 +150,79 @@ class Waiter(Utils):
           if self._ldtp_debug_file:
             with open(self._ldtp_debug_file, "a") as fp:
               fp.write(traceback.format_exc())
+        # A left over timer would poll, and quit, someone else's loop
+        self._cancel_timer()
+        self._record()
+        if self._app_exited and not self.success:
+          raise self._app_exited
         return self.success
 
+    def __getattr__(self, name):
+        if name == '_owner':
+            raise AttributeError(name)
+        return getattr(self._owner, name)
+
+    def _next_interval(self):
+        """
+        @return: seconds till the next poll
+        @rtype: float
+        """
+        if self.timeout_seconds:
+            return self.timeout_seconds
+        if self._interval is None:
+            self._interval = self.min_interval
+        else:
+            self._interval = min(self._interval * 2, self.poll_ceiling)
+        return self._interval
+
+    def _record(self):
+        """
+        Keep poll count and wait duration, for getwaitstats
+        """
+        self.polls = self._timeout_count
+        self.elapsed = time.time() - self._start
+        Waiter.history.append([self.__class__.__name__, self.polls,
+                               int(self.elapsed * 1000), bool(self.success)])
+        del Waiter.history[:-max_wait_history]
+
     def _timeout_thread_cb(self, params):
       # Thread callback takes params argument
       # but gobject.timeout_add_seconds doesn't
       self._timeout_cb()
 
+    def _cancel_timer(self):
+        """
+        Remove the pending poll, if any
+        """
+        if self._timer:
+            gobject.source_remove(self._timer)
+            self._timer = None
+        self._soon = False
+
+    def _schedule(self, seconds):
+        """
+        Poll again after seconds, or at the deadline if that comes first.
+        Replaces the pending poll, so there is only one chain of polls.
+        """
+        self._cancel_timer()
+        remaining = max(0, self._deadline - time.time())
+        self._timer = gobject.timeout_add(int(min(seconds, remaining) * 1000),
+                                          self._timeout_cb)
+
+    def _poll_soon(self, seconds = 0.02):
+        """
+        Poll shortly, instead of at the next tick. Used on events,
+        the short delay coalesces bursts of them.
+        """
+        if self._soon:
+            # Already polling shortly, don't postpone it
+            return
+        self._schedule(seconds)
+        self._soon = True
+
     def _timeout_cb(self):
+        self._timer = None
+        self._soon = False
         if self.success: # dispose of previous waiters.
             return False
         self._timeout_count += 1
@@ -112,8 +234,13 @@ class Waiter(Utils):
           if self._ldtp_debug_file:
             with open(self._ldtp_debug_file, "a") as fp:
               fp.write(traceback.format_exc())
-        if self._timeout_count * self.timeout_seconds > self.timeout or \
-               self.success:
+        if self._app_window and not self.success:
+          try:
+            self._check_app_exited(self._app_window)
+          except LdtpAppExitedException as e:
+            self._app_exited = e
+        if time.time() >= self._deadline or \
+               self.success or self._app_exited:
             try:
               # Required for wnck functions
               if _main_loop:
@@ -126,11 +253,27 @@ class Waiter(Utils):
               # If, gtk.main was already quit
               pass
             return False
-        return True
+        self._schedule(self._next_interval())
+        return False
     
     def poll(self):
         pass
 
+    def _has_state(self, obj, state):
+        """
+        @param state: State name, like sensitive or focused
+        @type state: string
+
+        @return: whether the object currently has the state
+        @rtype: boolean
+        """
+        _obj_state = obj.getState().getStates()
+        state = 'STATE_%s' % state.upper()
+        return (state in self._states and \
+                  self._states[state] in _obj_state) or \
+                  (state in self._states_old and \
+                     self._states_old[state] in _obj_state)
+
     def _event_cb(self, event):
       try:
         self.event_cb(event)
@@ -157,217 +300,147 @@ class Waiter(Utils):
         pass
 
 class NullWaiter(Waiter):
-    def __init__(self, return_value, timeout):
+    def __init__(self, return_value, timeout, owner = None):
         self._return_value = return_value
-        Waiter.__init__(self, timeout)
+        Waiter.__init__(self, timeout, owner)
 
     def run(self):
         Waiter.run(self)
         return self._return_value
 
-class MaximizeWindow(Waiter):
-    def __init__(self, frame_name):
-      Waiter.__init__(self, 0)
-      self._frame_name = frame_name
-
-    def poll(self):
-        while gtk.events_pending():
-          gtk.main_iteration()
+class WindowIndex(object):
+    """
+    Long lived wnck screen, its window list kept up to date from the
+    window-opened / window-closed signals instead of force_update
+    """
+    def __init__(self):
         if not gtk3:
-          screen = wnck.screen_get_default()
+          self.screen = wnck.screen_get_default()
         else:
-          screen = wnck.Screen.get_default()
-        screen.force_update()
-        window_list = screen.get_windows()
-        for w in window_list:
-            if self._frame_name:
-                current_window = w.get_name()
-                if re.search(
-                    fnmatch.translate(self._frame_name), current_window,
-                    re.U | re.M | re.L) \
-                    or re.search(fnmatch.translate(re.sub("(^frm)|(^dlg)", "",
-                                                          self._frame_name)),
-                                 re.sub(" *(\t*)|(\n*)", "", current_window),
-                                 re.U | re.M | re.L):
-                    # If window name specified, then maximize just that window
-                    w.maximize()
-                    self.success = True
-                    break
-            else:
-                # Maximize all window
-                w.maximize()
-                self.success = True
-
-class MinimizeWindow(Waiter):
-    def __init__(self, frame_name):
-        Waiter.__init__(self, 0)
-        self._frame_name = frame_name
-
-    def poll(self):
-        while gtk.events_pending():
-            gtk.main_iteration()
+          self.screen = wnck.Screen.get_default()
+        # Once, signals keep the list current afterwards
+        self.screen.force_update()
+        self.windows = list(self.screen.get_windows())
+        self.screen.connect('window-opened', self._window_opened)
+        self.screen.connect('window-closed', self._window_closed)
+
+    def _window_opened(self, screen, window):
+        if window not in self.windows:
+            self.windows.append(window)
+
+    def _window_closed(self, screen, window):
+        if window in self.windows:
+            self.windows.remove(window)
+
+    def can(self, window, action):
+        """
+        @param window: wnck window
+        @type window: object
+        @param action: Key of window_actions
+        @type action: string
+
+        @return: whether the window manager lets the window take the
+        action, desktop and dock windows never change state
+        @rtype: boolean
+        """
         if not gtk3:
-          screen = wnck.screen_get_default()
+          fixed_types = (wnck.WINDOW_DESKTOP, wnck.WINDOW_DOCK)
+          flag = getattr(wnck, 'WINDOW_ACTION_%s' % action.upper(), None)
         else:
-          screen = wnck.Screen.get_default()
-        screen.force_update()
-        window_list = screen.get_windows()
-        for w in window_list:
-            if self._frame_name:
-                current_window = w.get_name()
-                if re.search( \
-                    fnmatch.translate(self._frame_name), current_window,
-                    re.U | re.M | re.L) \
-                    or re.search(fnmatch.translate(re.sub("(^frm)|(^dlg)", "",
-                                                          self._frame_name)),
-                                 re.sub(" *(\t*)|(\n*)", "", current_window),
-                                 re.U | re.M | re.L):
-                    # If window name specified, then minimize just that window
-                    w.minimize()
-                    self.success = True
-                    break
-            else:
-                # Minimize all window
-                w.minimize()
-                self.success = True
-
-class UnmaximizeWindow(Waiter):
-    def __init__(self, frame_name):
-        Waiter.__init__(self, 0)
-        self._frame_name = frame_name
-
-    def poll(self):
-        while gtk.events_pending():
-            gtk.main_iteration()
-        if not gtk3:
-          screen = wnck.screen_get_default()
-        else:
-          screen = wnck.Screen.get_default()
-        screen.force_update()
-        window_list = screen.get_windows()
-        for w in window_list:
-            if self._frame_name:
-                current_window = w.get_name()
-                if re.search( \
-                    fnmatch.translate(self._frame_name), current_window,
-                    re.U | re.M | re.L) \
-                    or re.search(fnmatch.translate(re.sub("(^frm)|(^dlg)", "",
-                                                          self._frame_name)),
-                                 re.sub(" *(\t*)|(\n*)", "", current_window),
-                                 re.U | re.M | re.L):
-                    # If window name specified, then unmaximize just that window
-                    w.unmaximize()
-                    self.success = True
-                    break
-            else:
-                # Unmaximize all window
-                w.unmaximize()
-                self.success = True
-
-class UnminimizeWindow(Waiter):
-    def __init__(self, frame_name):
-        Waiter.__init__(self, 0)
-        self._frame_name = frame_name
-
-    def poll(self):
-        while gtk.events_pending():
-            gtk.main_iteration()
-        if not gtk3:
-          screen = wnck.screen_get_default()
-        else:
-          screen = wnck.Screen.get_default()
-        screen.force_update()
-        window_list = screen.get_windows()
-        for w in window_list:
-            if self._frame_name:
-                current_window = w.get_name()
-                if re.search( \
-                    fnmatch.translate(self._frame_name), current_window,
-                    re.U | re.M | re.L) \
-                    or re.search(fnmatch.translate(re.sub("(^frm)|(^dlg)", "",
-                                                          self._frame_name)),
-                                 re.sub(" *(\t*)|(\n*)", "", current_window),
-                                 re.U | re.M | re.L):
-                    # If window name specified, then unminimize just that window
-                    w.unminimize(int(time.time()))
-                    self.success = True
-                    break
-            else:
-                # Unminimize all window
-                w.unminimize(int(time.time()))
-                self.success = True
+          fixed_types = (wnck.WindowType.DESKTOP, wnck.WindowType.DOCK)
+          flag = getattr(wnck.WindowActions, action.upper(), None)
+        if window.get_window_type() in fixed_types:
+            return False
+        # activate has no action flag
+        return flag is None or bool(window.get_actions() & flag)
+
+    def match(self, frame_name):
+        """
+        @param frame_name: Window name, Unix glob, or LDTP name
+        @type frame_name: string
+
+        @return: windows matching the name, all windows if name is empty
+        @rtype: list
+        """
+        if not frame_name:
+            return list(self.windows)
+        window_list = []
+        for w in self.windows:
+            current_window = w.get_name()
+            if re.search(
+                fnmatch.translate(frame_name), current_window,
+                re.U | re.M | re.L) \
+                or re.search(fnmatch.translate(re.sub("(^frm)|(^dlg)", "",
+                                                      frame_name)),
+                             re.sub(" *(\t*)|(\n*)", "", current_window),
+                             re.U | re.M | re.L):
+                window_list.append(w)
+        return window_list
+
+# Window action and the check that it took effect
+window_actions = {
+    'maximize' : (lambda w: w.maximize(), lambda w: w.is_maximized()),
+    'unmaximize' : (lambda w: w.unmaximize(),
+                    lambda w: not w.is_maximized()),
+    'minimize' : (lambda w: w.minimize(), lambda w: w.is_minimized()),
+    'unminimize' : (lambda w: w.unminimize(int(time.time())),
+                    lambda w: not w.is_minimized()),
+    'activate' : (lambda w: w.activate(int(time.time())),
+                  lambda w: w.is_active()),
+    'close' : (lambda w: w.close(int(time.time())), None),
+    }
+
+class WindowStateWaiter(Waiter):
+    def __init__(self, index, windows, action, timeout, owner = None):
+        Waiter.__init__(self, timeout, owner)
+        # Completion comes from wnck signals, the only timer is
+        # the deadline
+        self.timeout_seconds = max(timeout, 0.01)
+        self._index = index
+        self._windows = windows
+        self._action, self._done = window_actions[action]
+        # Windows the action took effect on
+        self.done_windows = []
 
-class ActivateWindow(Waiter):
-    def __init__(self, frame_name):
-        Waiter.__init__(self, 0)
-        self._frame_name = frame_name
+    def run(self):
+        if not self._windows:
+            return False
+        handlers = []
+        for w in self._windows:
+            handlers.append((w, w.connect('state-changed', self._signal_cb)))
+        for signal in ('active-window-changed', 'window-closed'):
+            handlers.append((self._index.screen,
+                             self._index.screen.connect(signal,
+                                                        self._signal_cb)))
+        try:
+            for w in self._windows:
+                self._action(w)
+            return Waiter.run(self)
+        finally:
+            for obj, handler in handlers:
+                obj.disconnect(handler)
 
-    def poll(self):
-        while gtk.events_pending():
-            gtk.main_iteration()
-        if not gtk3:
-          screen = wnck.screen_get_default()
-        else:
-          screen = wnck.Screen.get_default()
-        screen.force_update()
-        window_list = screen.get_windows()
-        for w in window_list:
-            if self._frame_name:
-                current_window = w.get_name()
-                if re.search( \
-                    fnmatch.translate(self._frame_name), current_window,
-                    re.U | re.M | re.L) \
-                    or re.search(fnmatch.translate(re.sub("(^frm)|(^dlg)", "",
-                                                          self._frame_name)),
-                                 re.sub(" *(\t*)|(\n*)", "", current_window),
-                                 re.U | re.M | re.L):
-                    # If window name specified, then activate just that window
-                    w.activate(int(time.time()))
-                    self.success = True
-                    break
-            else:
-                break
+    def _signal_cb(self, *args):
+        self._event_cb(None)
 
-class CloseWindow(Waiter):
-    def __init__(self, frame_name):
-        Waiter.__init__(self, 0)
-        self._frame_name = frame_name
+    def event_cb(self, event):
+        self.poll()
 
     def poll(self):
-        while gtk.events_pending():
-            gtk.main_iteration()
-        if not gtk3:
-          screen = wnck.screen_get_default()
+        if self._done:
+            self.done_windows = [w for w in self._windows if self._done(w)]
         else:
-          screen = wnck.Screen.get_default()
-        # Added screen.force_update() based on
-        # http://stackoverflow.com/questions/5794309/how-can-i-get-a-list-of-windows-with-wnck-using-pygi
-        screen.force_update()
-        window_list = screen.get_windows()
-        for w in window_list:
-            if self._frame_name:
-                current_window = w.get_name()
-                if re.search( \
-                    fnmatch.translate(self._frame_name), current_window,
-                    re.U | re.M | re.L) \
-                    or re.search(fnmatch.translate(re.sub("(^frm)|(^dlg)", "",
-                                                          self._frame_name)),
-                                 re.sub(" *(\t*)|(\n*)", "", current_window),
-                                 re.U | re.M | re.L):
-                    # If window name specified, then close just that window
-                    w.close(int(time.time()))
-                    self.success = True
-                    break
-            else:
-                # Close all window
-                w.close(int(time.time()))
-                self.success = True
+            # Close is done once wnck reports the window closed
+            self.done_windows = [w for w in self._windows
+                                 if w not in self._index.windows]
+        self.success = len(self.done_windows) == len(self._windows)
 
 class GuiExistsWaiter(Waiter):
     events = ["window:create"]
-    def __init__(self, frame_name, timeout):
-        Waiter.__init__(self, timeout)
+    def __init__(self, frame_name, timeout, owner = None):
+        Waiter.__init__(self, timeout, owner)
         self._frame_name = frame_name
+        self._app_window = frame_name
         self.top_level = None # Useful in subclasses
 
     def poll(self):
@@ -388,8 +461,8 @@ class GuiExistsWaiter(Waiter):
 
 class GuiNotExistsWaiter(Waiter):
     events = ["window:destroy"]
-    def __init__(self, frame_name, timeout):
-        Waiter.__init__(self, timeout)
+    def __init__(self, frame_name, timeout, owner = None):
+        Waiter.__init__(self, timeout, owner)
         self.top_level = None
         self._frame_name = frame_name
 
@@ -409,26 +482,21 @@ class GuiNotExistsWaiter(Waiter):
             fp.write(traceback.format_exc())
 
 class ObjectExistsWaiter(GuiExistsWaiter):
-    def __init__(self, frame_name, obj_name, timeout, state = ''):
-      GuiExistsWaiter.__init__(self, frame_name, timeout)
-      self.timeout_seconds = 2
+    def __init__(self, frame_name, obj_name, timeout, state = '',
+                 owner = None):
+      GuiExistsWaiter.__init__(self, frame_name, timeout, owner)
       self._obj_name = obj_name
       self._state = state
 
     def poll(self):
         try:
           if self._obj_name and re.search(';', self._obj_name):
-            obj = self._get_menu_hierarchy(self._frame_name, self._obj_name)
+            obj = self._get_menu_hierarchy(self._frame_name, self._obj_name,
+                                           wait = False)
           else:
             obj = self._get_object(self._frame_name, self._obj_name, False)
           if self._state:
-            _state_inst = obj.getState()
-            _obj_state = _state_inst.getStates()
-            state = 'STATE_%s' % self._state.upper()
-            if (state in self._states and \
-                  self._states[state] in _obj_state) or \
-                  (state in self._states_old and \
-                     self._states_old[state] in _obj_state):
+            if self._has_state(obj, self._state):
               self.success = True
           else:
             self.success = True
@@ -444,21 +512,291 @@ class ObjectExistsWaiter(GuiExistsWaiter):
       self.success = False
 
 class ObjectNotExistsWaiter(GuiNotExistsWaiter):
-    def __init__(self, frame_name, obj_name, timeout):
-        GuiNotExistsWaiter.__init__(self, frame_name, timeout)
-        self.timeout_seconds = 2
+    def __init__(self, frame_name, obj_name, timeout, owner = None):
+        GuiNotExistsWaiter.__init__(self, frame_name, timeout, owner)
         self._obj_name = obj_name
 
     def poll(self):
         try:
             if re.search(';', self._obj_name):
-                self._get_menu_hierarchy(self._frame_name, self._obj_name)
+                self._get_menu_hierarchy(self._frame_name, self._obj_name,
+                                         wait = False)
             else:
                 self._get_object(self._frame_name, self._obj_name, False)
             self.success = False
         except:
             self.success = True
 
+class RegionStableWaiter(Waiter):
+    def __init__(self, capture, frames, interval, timeout, owner = None):
+        Waiter.__init__(self, timeout, owner)
+        self.timeout_seconds = interval
+        self._capture = capture
+        self._frames = frames
+        self._digest = None
+        self._matches = 0
+
+    def poll(self):
+        try:
+            pb = self._capture()
+        except Exception:
+            # Window closed or being rebuilt, start counting again
+            self._digest = None
+            self._matches = 0
+            self.success = False
+            return
+        self.add_frame(pb)
+
+    def add_frame(self, pb):
+        """
+        Count a captured frame
+
+        @param pb: captured region
+        @type pb: gdk.Pixbuf
+        """
+        # crc32 of the pixels is enough to tell frames apart, and
+        # doesn't keep the previous frame around
+        digest = (pb.get_width(), pb.get_height(),
+                  zlib.crc32(str(pb.get_pixels())))
+        del pb
+        if digest == self._digest:
+            self._matches += 1
+        else:
+            self._digest = digest
+            self._matches = 1
+        self.success = self._matches >= self._frames
+
+class IdleWaiter(Waiter):
+    events = ["object:children-changed", "object:property-change",
+              "object:state-changed"]
+    def __init__(self, app_name, quiet_ms, timeout, owner = None):
+        Waiter.__init__(self, timeout, owner)
+        self._quiet = quiet_ms / 1000.0
+        # Check a few times per quiet window
+        self.timeout_seconds = max(0.01, self._quiet / 5)
+        # Window name is mapped to its application, anything
+        # else is taken as application name glob
+        gui, _window_name = self._get_window_handle(app_name)
+        if gui:
+            self._app_name = gui.getApplication().name
+        else:
+            self._app_name = app_name
+        self._last_event = time.time()
+
+    def poll(self):
+        self.success = time.time() - self._last_event >= self._quiet
+
+    def event_cb(self, event):
+        app = getattr(event, 'host_application', None)
+        if not app:
+            app = event.source.getApplication()
+        if app and (app.name == self._app_name or \
+                        self._glob_match(self._app_name, app.name)):
+            self._last_event = time.time()
+
+class AppWindowWaiter(Waiter):
+    events = ["window:create"]
+    def __init__(self, targets, timeout, owner = None):
+        Waiter.__init__(self, timeout, owner)
+        # List of (pid, frame_name), waiting for a window of each
+        self._targets = targets
+        self.top_levels = [None] * len(targets)
+
+    def _match(self, gui, pid, frame_name):
+        if frame_name and self._match_name_to_acc(frame_name, gui):
+            return True
+        try:
+            return gui.getApplication().get_process_id() == pid
+        except:
+            # get_process_id exist only in pyatspi2
+            return False
+
+    def _check(self, gui):
+        for index, (pid, frame_name) in enumerate(self._targets):
+            if not self.top_levels[index] and \
+                    self._match(gui, pid, frame_name):
+                self.top_levels[index] = gui
+        self.success = None not in self.top_levels
+
+    def poll(self):
+        # Windows created before the listener was registered
+        for gui in self._list_guis():
+            self._check(gui)
+            if self.success:
+                break
+
+    def event_cb(self, event):
+        if event.source:
+            self._check(event.source)
+
+class CallbackWaiter(Waiter):
+    def __init__(self, callback, timeout, events, app = None,
+                 interval = 0.5, owner = None):
+        Waiter.__init__(self, timeout, owner)
+        self.events = events
+        # Fallback polling, for changes without events
+        self.poll_ceiling = min(interval, self.poll_ceiling)
+        self._callback = callback
+        self._app = app
+        self.result = None
+        # Callers have just tried, don't repeat the lookup right away
+        self._skip_poll = True
+
+    def poll(self):
+        if self._skip_poll:
+            self._skip_poll = False
+            return
+        try:
+            self.result = self._callback()
+        except LdtpAppExitedException as e:
+            self._app_exited = e
+            return
+        self.success = bool(self.result)
+
+    def event_cb(self, event):
+        if self._app and event.host_application != self._app:
+            return
+        self._poll_soon()
+
+class ConditionsWaiter(Waiter):
+    events = ["window:create", "window:destroy", "object:children-changed",
+              "object:state-changed", "object:property-change:accessible-name"]
+    def __init__(self, conditions, match_all, timeout, owner = None):
+        Waiter.__init__(self, timeout, owner)
+        # List of (frame_name, obj_name, state, exists)
+        self._conditions = conditions
+        self._match_all = match_all
+        self.index = -1
+
+    def _condition_met(self, frame_name, obj_name, state, exists):
+        try:
+            if obj_name:
+                if re.search(';', obj_name):
+                    obj = self._get_menu_hierarchy(frame_name, obj_name,
+                                                   wait = False)
+                else:
+                    obj = self._get_object(frame_name, obj_name, False)
+                found = not state or self._has_state(obj, state)
+            else:
+                gui, _window_name = self._get_window_handle(frame_name)
+                found = bool(gui)
+        except:
+            found = False
+        return found == bool(exists)
+
+    def poll(self):
+        for index, condition in enumerate(self._conditions):
+            met = self._condition_met(*condition)
+            if self._match_all and not met:
+                return
+            if not self._match_all and met:
+                self.index = index
+                self.success = True
+                return
+        self.success = self._match_all
+
+    def _in_window(self, frame_name, acc):
+        """
+        @return: whether acc is inside the window named frame_name, so a
+        widget of the same name elsewhere doesn't count
+        @rtype: boolean
+        """
+        try:
+            while acc.parent and \
+                    acc.parent.getRole() != pyatspi.ROLE_APPLICATION:
+                acc = acc.parent
+        except:
+            return False
+        return bool(self._match_name_to_acc(frame_name, acc))
+
+    def _event_met(self, event):
+        """
+        @return: index of the condition the event itself satisfies,
+        for windows or states that may not last till the next poll,
+        -1 if none
+        @rtype: integer
+        """
+        for index, (frame_name, obj_name, state, exists) in \
+                enumerate(self._conditions):
+            if obj_name:
+                if state and event.type.startswith(
+                    'object:state-changed:%s' % \
+                        state.lower().replace('_', '-')) and \
+                        bool(event.detail1) == bool(exists) and \
+                        self._match_name_to_acc(obj_name, event.source) and \
+                        self._in_window(frame_name, event.source):
+                    return index
+            elif event.type.startswith(
+                exists and 'window:create' or 'window:destroy') and \
+                    self._match_name_to_acc(frame_name, event.source):
+                return index
+        return -1
+
+    def event_cb(self, event):
+        if not self._match_all:
+            index = self._event_met(event)
+            if index != -1:
+                self.index = index
+                self.success = True
+                return
+        # One subscription for all the conditions, poll them together
+        self._poll_soon()
+
+class StateWaiter(Waiter):
+    def __init__(self, frame_name, obj_name, obj, state, present, timeout,
+                 owner = None):
+        Waiter.__init__(self, timeout, owner)
+        self._frame_name = frame_name
+        self._obj_name = obj_name
+        self._obj = obj
+        self._state = state
+        self._present = bool(present)
+        # Only changes of this state, polling is just a fallback
+        self.events = ['object:state-changed:%s' % \
+                           state.lower().replace('_', '-')]
+
+    def _current(self):
+        """
+        @return: the object, resolved again if the application rebuilt
+        it, None if it is gone
+        @rtype: object
+        """
+        try:
+            if self._obj and \
+                    not self._obj.getState().contains(pyatspi.STATE_DEFUNCT) \
+                    and self._match_name_to_acc(
+                re.split(';', self._obj_name)[-1], self._obj):
+                return self._obj
+        except:
+            pass
+        try:
+            if re.search(';', self._obj_name):
+                self._obj = self._get_menu_hierarchy(self._frame_name,
+                                                     self._obj_name,
+                                                     wait = False)
+            else:
+                self._obj = self._get_object(self._frame_name,
+                                             self._obj_name, False)
+        except:
+            self._obj = None
+        return self._obj
+
+    def poll(self):
+        obj = self._current()
+        if not obj:
+            # Gone, so it doesn't have the state either
+            self.success = not self._present
+            return
+        self.success = self._has_state(obj, self._state) == self._present
+
+    def event_cb(self, event):
+        if event.source == self._obj:
+            if bool(event.detail1) == self._present:
+                self.success = True
+        else:
+            # Could be the same widget, recreated
+            self._poll_soon()
+
 if __name__ == "__main__":
     waiter = ObjectExistsWaiter('frmCalculator', 'mnuEitanIsaacsonFoo', 0)
     print(waiter.run())
@@ -22,10 +22,14 @@ Headers in this file shall remain intact.
 import os
 import re
 import time
+import zlib
 import core
 from core import Ldtpd
-from twisted.web import xmlrpc
+from StringIO import StringIO
+from twisted.web import xmlrpc, server
+from twisted.protocols import basic
 import xmlrpclib
+import traceback
 from log import logger
 
 if 'LDTP_COMMAND_DELAY' in os.environ:
@@ -36,6 +40,24 @@ else:
 _ldtp_debug = os.environ.get('LDTP_DEBUG', None)
 _ldtp_debug_file = os.environ.get('LDTP_DEBUG_FILE', None)
 
+# Responses smaller than this many bytes are sent uncompressed,
+# a negative value disables gzip encoding
+try:
+    gzip_threshold = int(os.environ.get('LDTP_GZIP_THRESHOLD', 1400))
+except ValueError:
+    gzip_threshold = 1400
+# Level 1 gives almost the same ratio as 6 on XML / base64 payloads,
+# at a fraction of the CPU time
+gzip_level = 1
+
+def _gzip_encode(data):
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def _gzip_decode(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
 class XMLRPCLdtpd(Ldtpd, xmlrpc.XMLRPC, object):
     def __new__(cls, *args, **kwargs):
         for symbol in dir(Ldtpd):
@@ -71,11 +93,66 @@ class XMLRPCLdtpd(Ldtpd, xmlrpc.XMLRPC, object):
 
             return xmlrpclib.Fault(self.FAILURE, value)
 
+    def _cbRender(self, result, request, responseFailed=None):
+        if responseFailed:
+            return
+        if not isinstance(result, xmlrpclib.Fault):
+            result = (result,)
+        try:
+            try:
+                content = xmlrpclib.dumps(result, methodresponse=True,
+                                          allow_none=self.allowNone)
+            except Exception as e:
+                f = xmlrpc.Fault(self.FAILURE,
+                                 "Can't serialize output: %s" % (e,))
+                content = xmlrpclib.dumps(f, methodresponse=True,
+                                          allow_none=self.allowNone)
+            if isinstance(content, unicode):
+                content = content.encode('utf-8')
+            accept_encoding = request.getHeader('accept-encoding') or ''
+            if gzip_threshold >= 0 and len(content) >= gzip_threshold and \
+                    'gzip' in accept_encoding.lower():
+                # Large payloads (imagecapture, getobjectlist etc)
+                # are compressed, only if the client can handle it
+                content = _gzip_encode(content)
+                request.setHeader("content-encoding", "gzip")
+            request.setHeader("content-length", str(len(content)))
+            request.write(content)
+        except:
+            if _ldtp_debug:
+                print(traceback.format_exc())
+        request.finish()
+
+    def render_GET(self, request):
+        # GET /imagecapture/<token> streams the screenshot stored by
+        # imagecapturestore, the XML-RPC calls are all POST
+        if len(request.postpath) != 2 or request.postpath[0] != 'imagecapture':
+            request.setResponseCode(404)
+            return ''
+        image = self._pop_captured_image(request.postpath[1])
+        if not image:
+            request.setResponseCode(404)
+            return ''
+        data, mime_type = image
+        request.setHeader("content-type", mime_type)
+        request.setHeader("content-length", str(len(data)))
+        # FileSender honours the transport back pressure,
+        # so the image is written out in chunks
+        d = basic.FileSender().beginFileTransfer(StringIO(data), request)
+        d.addCallback(lambda ignored: request.finish())
+        # Client went away, nothing left to finish
+        d.addErrback(lambda failure: None)
+        return server.NOT_DONE_YET
+
     def render_POST(self, request):
         request.content.seek(0, 0)
         request.setHeader("content-type", "text/xml")
         try:
-            args, functionPath = xmlrpclib.loads(request.content.read())
+            data = request.content.read()
+            content_encoding = request.getHeader('content-encoding') or ''
+            if content_encoding.lower() == 'gzip':
+                data = _gzip_decode(data)
+            args, functionPath = xmlrpclib.loads(data)
             if args and isinstance(args[-1], dict):
                 # Passing args and kwargs to _ldtp_callback
                 # fail, so using self, kind of work around !
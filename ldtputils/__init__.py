@@ -22,32 +22,25 @@ import ldtp
 from ldtp import imagecapture
 import xml.dom.minidom
 
-def imagecompare(imgfile1, imgfile2):
-    try:
-        import ImageChops, Image
-    except ImportError:
-        raise Exception('Python-Imaging package not installed')
-    try:
-        diffcount = 0.0
-        im1 = Image.open(imgfile1)
-        im2 = Image.open(imgfile2)
-
-        imgcompdiff = ImageChops.difference(im1, im2)
-        diffboundrect = imgcompdiff.getbbox()
-        imgdiffcrop = imgcompdiff.crop(diffboundrect)
-
-        data = imgdiffcrop.getdata()
-
-        seq = []
-        for row in data:
-            seq += list(row)
-
-        for i in xrange(0, imgdiffcrop.size[0] * imgdiffcrop.size[1] * 3, 3):
-            if seq[i] != 0 or seq[i+1] != 0 or seq[i+2] != 0:
-                diffcount = diffcount + 1.0
-        
-        diffImgLen = imgcompdiff.size[0] * imgcompdiff.size[1] * 1.0
-        diffpercent = (diffcount * 100) / diffImgLen
-        return diffpercent
-    except IOError:
-        raise Exception('Input file does not exist')
+from ldtpd.imaging import numpy, _import_pil, _imagecompare_legacy, \
+     imagediff, pairsfromdirs, pairsfrommanifest, comparebatch, summarize
+
+def imagecompare(imgfile1, imgfile2, tolerance=0, mask=None):
+    """
+    Compare two images
+
+    @param imgfile1: First image file name
+    @type imgfile1: string
+    @param imgfile2: Second image file name
+    @type imgfile2: string
+    @param tolerance: Largest per channel difference still treated as
+    equal, either one value or an (R, G, B) tuple
+    @type tolerance: integer
+    @param mask: Regions to ignore, a list of (x, y, width, height)
+    boxes or an image file whose non black pixels are ignored
+    @type mask: list
+
+    @return: Percentage of differing pixels
+    @rtype: float
+    """
+    return imagediff(imgfile1, imgfile2, tolerance, mask)[0]
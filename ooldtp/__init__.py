@@ -422,8 +422,11 @@ class ooldtp:
         return self._remote_doesrowexist(window_name, object_name, row_text, partial_match)
     def getchild(self, window_name, child_name = '', role = '', parent = ''):
         return self._remote_getchild(window_name, child_name, role, parent)
-    def enterstring(self, window_name, object_name = '', data = ''):
-        return self._remote_enterstring(window_name, object_name, data)
+    def enterstring(self, window_name, object_name = '', data = '', fast = 0):
+        if not fast:
+            # Keep the call compatible with Windows / Mac ldtpd
+            return self._remote_enterstring(window_name, object_name, data)
+        return self._remote_enterstring(window_name, object_name, data, fast)
     def setvalue(self, window_name, object_name, data):
         return self._remote_setvalue(window_name, object_name, float(data))
     def grabfocus(self, window_name, object_name = ''):
@@ -36,7 +36,7 @@ setup(name="ldtp",
           "Accessibility libraries to poke through the applications user " \
           "interface. LDTP is a Linux / Unix GUI application testing tool. " \
           "It runs on Linux / Windows / Mac OSX / Solaris / FreeBSD / Embedded environment (Palm Source).",
-      scripts=["scripts/ldtp"],
+      scripts=["scripts/ldtp", "scripts/ldtpimagediff"],
       classifiers=[
         "Development Status :: 5 - Production",
         "Environment :: X11 Applications :: GTK",
@@ -0,0 +1,136 @@
+"""
+Tests for the ldtp client transport, run with python -m unittest discover tests
+
+@license: LGPL
+
+http://ldtp.freedesktop.org
+
+This file may be distributed and/or modified under the terms of the GNU Lesser General
+Public License version 2 as published by the Free Software Foundation. This file
+is distributed without any warranty; without even the implied warranty of
+merchantability or fitness for a particular purpose.
+
+See "COPYING" in the source distribution for more information.
+
+Headers in this file shall remain intact.
+"""
+
+import os
+import sys
+import gzip
+import types
+import threading
+import unittest
+from io import BytesIO
+
+try:
+    import xmlrpclib
+except ImportError:
+    import xmlrpc.client as xmlrpclib
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# Importing the ldtp package connects to ldtpd, spawning it if needed.
+# Register a bare package instead, so only ldtp.client gets imported.
+if 'ldtp' not in sys.modules:
+    _package = types.ModuleType('ldtp')
+    _package.__path__ = [os.path.join(os.path.dirname(
+                os.path.abspath(__file__)), '..', 'ldtp')]
+    sys.modules['ldtp'] = _package
+from ldtp import client
+
+def _gzip(data):
+    buf = BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+def _gunzip(data):
+    return gzip.GzipFile(fileobj=BytesIO(data)).read()
+
+class _Handler(BaseHTTPRequestHandler):
+    # Echoes the first argument back, like a small ldtpd
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['content-length']))
+        self.server.requests.append(dict(self.headers.items()))
+        if self.headers.get('content-encoding') == 'gzip':
+            body = _gunzip(body)
+        params, method = xmlrpclib.loads(body)
+        if params:
+            response = xmlrpclib.dumps(params[:1], methodresponse=True)
+        else:
+            response = xmlrpclib.dumps(xmlrpclib.Fault(client.ERROR_CODE,
+                                                       'Nothing to echo'),
+                                       methodresponse=True)
+        response = response.encode('utf-8')
+        gzipped = 'gzip' in self.headers.get('accept-encoding', '') and \
+            self.server.gzip_responses
+        if gzipped:
+            response = _gzip(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        self.server.gzip_responses = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.proxy = client.LdtpClient('http://127.0.0.1:%d' % \
+                                           self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _headers(self):
+        return dict((key.lower(), value) for key, value in
+                    self.server.requests[-1].items())
+
+    @unittest.skipUnless(client._ldtp_gzip_threshold >= 0,
+                         'gzip disabled by LDTP_GZIP_THRESHOLD')
+    def test_gzip_response(self):
+        self.assertEqual(self.proxy.echo('hello'), 'hello')
+        self.assertEqual(self._headers().get('accept-encoding'), 'gzip')
+
+    @unittest.skipUnless(client._ldtp_gzip_threshold >= 0,
+                         'gzip disabled by LDTP_GZIP_THRESHOLD')
+    def test_gzip_response_over_20mb(self):
+        # xmlrpclib.gzip_decode refuses more than 20MB once decoded
+        data = 'x' * (21 * 1024 * 1024)
+        self.assertEqual(len(self.proxy.echo(data)), len(data))
+
+    def test_plain_response(self):
+        self.server.gzip_responses = False
+        self.assertEqual(self.proxy.echo('hello'), 'hello')
+
+    @unittest.skipUnless(getattr(client.Transport, 'encode_threshold',
+                                 None) is not None,
+                         'gzip encoded requests disabled')
+    def test_gzip_request(self):
+        data = 'x' * (client.Transport.encode_threshold + 1)
+        self.assertEqual(self.proxy.echo(data), data)
+        self.assertEqual(self._headers().get('content-encoding'), 'gzip')
+        self.proxy.echo('small')
+        self.assertEqual(self._headers().get('content-encoding'), None)
+
+    def test_fault(self):
+        for gzip_responses in (False, True):
+            self.server.gzip_responses = gzip_responses
+            self.assertRaises(client.LdtpExecutionError, self.proxy.echo)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+"""
+Tests for ldtpd.imaging, run with python -m unittest discover tests
+
+@license: LGPL
+
+http://ldtp.freedesktop.org
+
+This file may be distributed and/or modified under the terms of the GNU Lesser General
+Public License version 2 as published by the Free Software Foundation. This file
+is distributed without any warranty; without even the implied warranty of
+merchantability or fitness for a particular purpose.
+
+See "COPYING" in the source distribution for more information.
+
+Headers in this file shall remain intact.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+# ldtpd modules use implicit relative imports, import them as top level
+# modules so the package __init__ doesn't pull in twisted and pyatspi
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'ldtpd'))
+import imaging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def _image(width, height, color=(0, 0, 0)):
+    return Image.new('RGB', (width, height), color)
+
+@unittest.skipUnless(imaging.numpy is not None and Image is not None,
+                     'numpy and PIL are required')
+class ImageDiffTest(unittest.TestCase):
+    def test_identical(self):
+        self.assertEqual(imaging.imagediff(_image(8, 8), _image(8, 8)),
+                         (0.0, None))
+
+    def test_changed_pixels(self):
+        im2 = _image(10, 10)
+        im2.putpixel((2, 3), (255, 0, 0))
+        im2.putpixel((5, 7), (0, 0, 1))
+        percent, bbox = imaging.imagediff(_image(10, 10), im2)
+        self.assertAlmostEqual(percent, 2.0)
+        self.assertEqual(bbox, (2, 3, 6, 8))
+
+    def test_tolerance(self):
+        im2 = _image(4, 4, (10, 20, 30))
+        self.assertEqual(imaging.imagediff(_image(4, 4), im2, 30),
+                         (0.0, None))
+        self.assertEqual(imaging.imagediff(_image(4, 4), im2, 29)[0], 100.0)
+        # Per channel, only blue is over its tolerance
+        self.assertEqual(imaging.imagediff(_image(4, 4), im2,
+                                           (10, 20, 29))[0], 100.0)
+        self.assertEqual(imaging.imagediff(_image(4, 4), im2,
+                                           (10, 20, 30))[0], 0.0)
+
+    def test_tolerance_both_directions(self):
+        # The uint8 subtraction must not wrap around
+        percent, bbox = imaging.imagediff(_image(2, 1, (200, 0, 0)),
+                                          _image(2, 1, (190, 0, 0)), 10)
+        self.assertEqual(percent, 0.0)
+        percent, bbox = imaging.imagediff(_image(2, 1, (190, 0, 0)),
+                                          _image(2, 1, (200, 0, 0)), 10)
+        self.assertEqual(percent, 0.0)
+
+    def test_mask_boxes(self):
+        im2 = _image(10, 10)
+        im2.putpixel((1, 1), (255, 255, 255))
+        im2.putpixel((8, 8), (255, 255, 255))
+        percent, bbox = imaging.imagediff(_image(10, 10), im2,
+                                          mask=[(0, 0, 5, 5)])
+        # Masked pixels are left out of the compared total too
+        self.assertAlmostEqual(percent, 100.0 / 75)
+        self.assertEqual(bbox, (8, 8, 9, 9))
+
+    def test_mask_image(self):
+        im2 = _image(4, 4)
+        im2.putpixel((0, 0), (255, 255, 255))
+        mask = _image(4, 4)
+        mask.putpixel((0, 0), (1, 1, 1))
+        self.assertEqual(imaging.imagediff(_image(4, 4), im2, mask=mask),
+                         (0.0, None))
+
+    def test_size_mismatch(self):
+        percent, bbox = imaging.imagediff(_image(10, 10), _image(12, 10))
+        self.assertAlmostEqual(percent, 20 * 100.0 / 120)
+        self.assertEqual(bbox, (10, 0, 12, 10))
+
+    def test_legacy_engine_agrees(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            im1 = os.path.join(tmpdir, 'a.png')
+            im2 = os.path.join(tmpdir, 'b.png')
+            _image(10, 10).save(im1)
+            changed = _image(12, 11)
+            changed.putpixel((1, 1), (9, 9, 9))
+            changed.save(im2)
+            self.assertEqual(imaging._imagecompare_legacy(im1, im2),
+                             imaging.imagediff(im1, im2))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_missing_file(self):
+        self.assertRaises(Exception, imaging.imagediff,
+                          '/nonexistent/a.png', '/nonexistent/b.png')
+
+@unittest.skipUnless(imaging.numpy is not None and Image is not None,
+                     'numpy and PIL are required')
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.baseline = os.path.join(self.tmpdir, 'baseline')
+        self.result = os.path.join(self.tmpdir, 'result')
+        for directory in (self.baseline, self.result,
+                          os.path.join(self.baseline, 'sub'),
+                          os.path.join(self.result, 'sub')):
+            os.mkdir(directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _save(self, image, *path):
+        image.save(os.path.join(self.tmpdir, *path))
+
+    def test_pairsfromdirs(self):
+        self._save(_image(2, 2), 'baseline', 'b.png')
+        self._save(_image(2, 2), 'baseline', 'sub', 'a.png')
+        open(os.path.join(self.baseline, 'notes.txt'), 'w').close()
+        pairs = imaging.pairsfromdirs(self.baseline, self.result)
+        self.assertEqual([pair['name'] for pair in pairs],
+                         ['b.png', os.path.join('sub', 'a.png')])
+        self.assertEqual(pairs[1]['result'],
+                         os.path.join(self.result, 'sub', 'a.png'))
+
+    def test_pairsfrommanifest(self):
+        manifest = os.path.join(self.tmpdir, 'manifest.jsonl')
+        with open(manifest, 'w') as fp:
+            fp.write('# comment\n\n')
+            fp.write(json.dumps({'baseline' : 'baseline/a.png',
+                                 'result' : 'result/a.png',
+                                 'mask' : 'mask.png'}) + '\n')
+            fp.write(json.dumps({'name' : 'boxes',
+                                 'baseline' : '/abs/b.png',
+                                 'result' : 'result/b.png',
+                                 'mask' : [[0, 0, 1, 1]]}) + '\n')
+        first, second = imaging.pairsfrommanifest(manifest)
+        self.assertEqual(first['baseline'],
+                         os.path.join(self.baseline, 'a.png'))
+        self.assertEqual(first['mask'], os.path.join(self.tmpdir, 'mask.png'))
+        self.assertEqual(first['name'], first['result'])
+        self.assertEqual(second['baseline'], '/abs/b.png')
+        self.assertEqual(second['mask'], [[0, 0, 1, 1]])
+        self.assertEqual(second['name'], 'boxes')
+
+    def test_comparebatch_and_summarize(self):
+        changed = _image(10, 10)
+        changed.putpixel((0, 0), (255, 255, 255))
+        for name, result in (('same.png', _image(10, 10)),
+                             ('changed.png', changed),
+                             ('missing.png', None)):
+            self._save(_image(10, 10), 'baseline', name)
+            if result is not None:
+                self._save(result, 'result', name)
+        pairs = imaging.pairsfromdirs(self.baseline, self.result)
+        # summarize must take the generator comparebatch returns
+        summary = imaging.summarize(imaging.comparebatch(pairs,
+                                                         processes=1))
+        self.assertEqual(summary['compared'], 2)
+        self.assertEqual(summary['identical'], 1)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual([result['name'] for result in summary['worst']],
+                         ['changed.png'])
+        self.assertEqual(summary['worst'][0]['percent'], 1.0)
+        self.assertEqual(summary['worst'][0]['bbox'], [0, 0, 1, 1])
+        self.assertEqual(summary['errors'][0]['name'], 'missing.png')
+
+    def test_summarize_top(self):
+        results = [{'name' : str(percent), 'percent' : percent}
+                   for percent in (1.0, 0.0, 5.0, 3.0)]
+        summary = imaging.summarize(iter(results), top=2)
+        self.assertEqual([result['percent'] for result in summary['worst']],
+                         [5.0, 3.0])
+        self.assertEqual(summary['identical'], 1)
+
+class ChangedTilesTest(unittest.TestCase):
+    # 10x7 RGB frame, rows padded to 32 bytes and the last row unpadded
+    width, height, rowstride, channels = 10, 7, 32, 3
+
+    def _frame(self, changes=()):
+        row_size = self.width * self.channels
+        data = bytearray(self.rowstride * (self.height - 1) + row_size)
+        for x, y in changes:
+            data[y * self.rowstride + x * self.channels + 2] = 255
+        return bytes(data)
+
+    def _tiles(self, changes, tile_size=4):
+        return imaging._changed_tiles(self._frame(), self._frame(changes),
+                                      self.width, self.height,
+                                      self.rowstride,
+                                      self.width * self.channels, tile_size)
+
+    def _check(self, changes, expected, tile_size=4):
+        self.assertEqual(self._tiles(changes, tile_size), expected)
+        numpy = imaging.numpy
+        imaging.numpy = None
+        try:
+            # The fallback without numpy agrees
+            self.assertEqual(self._tiles(changes, tile_size), expected)
+        finally:
+            imaging.numpy = numpy
+
+    def test_unchanged(self):
+        self._check([], [])
+
+    def test_partial_tiles(self):
+        # Right column and bottom row tiles are smaller
+        self._check([(9, 6)], [(8, 4, 2, 3)])
+
+    def test_order(self):
+        self._check([(9, 0), (0, 5), (1, 1), (5, 4)],
+                    [(0, 0, 4, 4), (8, 0, 2, 4), (0, 4, 4, 3),
+                     (4, 4, 4, 3)])
+
+    def test_padding_ignored(self):
+        previous = self._frame()
+        current = bytearray(previous)
+        # Bytes between row end and rowstride are not pixels
+        current[self.width * self.channels] = 1
+        self.assertEqual(imaging._changed_tiles(previous, bytes(current),
+                                                self.width, self.height,
+                                                self.rowstride,
+                                                self.width * self.channels,
+                                                4), [])
+
+    def test_whole_frame_tile(self):
+        self._check([(3, 3)], [(0, 0, 10, 7)], tile_size=64)
+
+@unittest.skipUnless(imaging.numpy is not None, 'numpy is required')
+class LocateTemplateTest(unittest.TestCase):
+    def _scene(self, width, height):
+        numpy = imaging.numpy
+        # Random pixels, so the template has one clear best match
+        state = numpy.random.RandomState(1)
+        scene = state.randint(0, 256, (height, width, 3)).astype(numpy.uint8)
+        return scene
+
+    def test_small_template(self):
+        scene = self._scene(40, 30)
+        x, y, score = imaging.locatetemplate(scene, scene[7:15, 11:21])
+        self.assertEqual((x, y), (11, 7))
+        self.assertAlmostEqual(score, 1.0, 3)
+
+    def test_pyramid_search(self):
+        # Large enough for the downscaled coarse search
+        scene = self._scene(200, 150)
+        x, y, score = imaging.locatetemplate(scene, scene[61:121, 37:117])
+        self.assertEqual((x, y), (37, 61))
+        self.assertAlmostEqual(score, 1.0, 3)
+
+    def test_template_too_large(self):
+        scene = self._scene(10, 10)
+        self.assertRaises(Exception, imaging.locatetemplate,
+                          scene[:5, :5], scene)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+"""
+Tests for ldtpd.script, run with python -m unittest discover tests
+
+@license: LGPL
+
+http://ldtp.freedesktop.org
+
+This file may be distributed and/or modified under the terms of the GNU Lesser General
+Public License version 2 as published by the Free Software Foundation. This file
+is distributed without any warranty; without even the implied warranty of
+merchantability or fitness for a particular purpose.
+
+See "COPYING" in the source distribution for more information.
+
+Headers in this file shall remain intact.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+# ldtpd modules use implicit relative imports, import them as top level
+# modules so the package __init__ doesn't pull in the whole daemon
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'ldtpd'))
+try:
+    from script import Script
+    from server_exception import LdtpServerException
+except ImportError:
+    # Needs twisted, pyatspi and gobject
+    Script = None
+
+class _Owner(object):
+    """
+    Stands in for Ldtpd, records the calls scripts make
+    """
+    def __init__(self, failures=0, wait_index=0):
+        self.calls = []
+        self.value = 3
+        self._failures = failures
+        self._wait_index = wait_index
+
+    def click(self, name):
+        self.calls.append(('click', name))
+        return 1
+
+    def getvalue(self):
+        self.calls.append(('getvalue',))
+        return self.value
+
+    def flaky(self):
+        self.calls.append(('flaky',))
+        if self._failures:
+            self._failures -= 1
+            raise LdtpServerException('Not yet')
+        return 1
+
+    def sleep(self, milliseconds):
+        time.sleep(milliseconds / 1000.0)
+
+    def waittillany(self, conditions, timeout):
+        self.calls.append(('waittillany', conditions, timeout))
+        return self._wait_index
+
+    def runscript(self, script, max_jitter=0):
+        pass
+
+    def _private(self):
+        pass
+
+@unittest.skipUnless(Script and sys.version_info[0] == 2,
+                     'ldtpd runs on Python 2 with twisted and gobject')
+class ScriptCompileTest(unittest.TestCase):
+    def _error(self, steps):
+        owner = _Owner()
+        try:
+            Script(owner, steps).run()
+        except LdtpServerException as e:
+            # Nothing runs when any step is invalid
+            self.assertEqual(owner.calls, [])
+            return e.faultString
+        self.fail('%r compiled' % (steps,))
+
+    def test_not_a_list(self):
+        self.assertEqual(self._error('click'), 'Script steps must be a list')
+
+    def test_empty_step(self):
+        self.assertEqual(self._error([['click', 'a'], []]),
+                         'Empty script step 2')
+
+    def test_invalid_step(self):
+        self.assertEqual(self._error([5]), 'Invalid script step 1')
+        self.assertEqual(self._error([{'click' : 'a'}]),
+                         'Invalid script step 1')
+
+    def test_reserved_calls(self):
+        self.assertEqual(self._error([['runscript', []]]),
+                         'Invalid script call runscript')
+        self.assertEqual(self._error([['_private']]),
+                         'Invalid script call _private')
+        self.assertEqual(self._error([[5]]), 'Invalid script call 5')
+
+    def test_unknown_call(self):
+        self.assertEqual(self._error([{'assert' : 'nosuch'}]),
+                         'Unknown script call nosuch')
+
+    def test_nested_steps_checked_first(self):
+        self.assertEqual(self._error([['click', 'a'],
+                                      {'sequence' : [['click', 'b'],
+                                                     {'retry' : [[]]}]}]),
+                         'Empty script step 2.2.1')
+
+@unittest.skipUnless(Script and sys.version_info[0] == 2,
+                     'ldtpd runs on Python 2 with twisted and gobject')
+class ScriptRunTest(unittest.TestCase):
+    def _run(self, steps, owner=None, max_jitter=0):
+        script = Script(owner or _Owner(), steps, max_jitter)
+        return script.run(), script.report.rows
+
+    def test_rows(self):
+        ok, rows = self._run([['click', 'a'],
+                              {'assert' : 'getvalue', 'expect' : 3},
+                              {'call' : 'click', 'args' : ['b']}])
+        self.assertTrue(ok)
+        self.assertEqual([row[:3] for row in rows],
+                         [['1', 'call', 'click'], ['2', 'assert', 'getvalue'],
+                          ['3', 'call', 'click']])
+        self.assertEqual([row[6] for row in rows], [1, 1, 1])
+        self.assertEqual([row[7] for row in rows], [1, 3, 1])
+
+    def test_stops_at_failed_assert(self):
+        owner = _Owner()
+        owner.value = 0
+        ok, rows = self._run([{'assert' : 'getvalue'}, ['click', 'a']],
+                             owner)
+        self.assertFalse(ok)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][6], 0)
+        self.assertEqual(rows[0][7], 'Assertion failed, got 0')
+        self.assertEqual(owner.calls, [('getvalue',)])
+
+    def test_delay_keeps_cadence(self):
+        ok, rows = self._run([{'call' : 'sleep', 'args' : [40]},
+                              {'call' : 'click', 'args' : ['a'],
+                               'delay' : 50},
+                              {'call' : 'click', 'args' : ['b'],
+                               'delay' : 50}])
+        self.assertTrue(ok)
+        # Planned after the previous plan, not after the sleep ended
+        planned = [row[3] for row in rows]
+        self.assertTrue(abs(planned[1] - planned[0] - 50) <= 1, planned)
+        self.assertTrue(abs(planned[2] - planned[0] - 100) <= 1, planned)
+
+    def test_max_jitter(self):
+        ok, rows = self._run([{'call' : 'sleep', 'args' : [60]},
+                              {'call' : 'click', 'args' : ['a'],
+                               'delay' : 10}], max_jitter=20)
+        self.assertFalse(ok)
+        self.assertTrue(rows[1][7].startswith('Started '), rows[1][7])
+
+    def test_wait(self):
+        owner = _Owner(wait_index=1)
+        ok, rows = self._run([{'wait' : [['guiexist', 'frm']],
+                               'timeout' : 5}], owner)
+        self.assertTrue(ok)
+        self.assertEqual(rows[0][7], 1)
+        self.assertEqual(owner.calls,
+                         [('waittillany', [['guiexist', 'frm']], 5)])
+        ok, rows = self._run([{'wait' : []}], _Owner(wait_index=-1))
+        self.assertFalse(ok)
+        self.assertEqual(rows[0][7], 'Wait timed out')
+
+    def test_sequence(self):
+        ok, rows = self._run([{'sequence' : [['click', 'a'],
+                                             {'assert' : 'flaky'}]},
+                              ['click', 'b']], _Owner(failures=1))
+        self.assertFalse(ok)
+        # Parent rows come before their children
+        self.assertEqual([row[0] for row in rows], ['1', '1.1', '1.2'])
+        self.assertEqual(rows[0][7], 'Step 1.2 failed')
+
+    def test_retry(self):
+        owner = _Owner(failures=2)
+        ok, rows = self._run([{'retry' : [['click', 'a'], ['flaky']],
+                               'times' : 3, 'interval' : 30}], owner)
+        self.assertTrue(ok)
+        self.assertEqual([row[0] for row in rows],
+                         ['1', '1.1', '1.2', '1.1', '1.2', '1.1', '1.2'])
+        self.assertEqual([row[6] for row in rows], [1, 1, 0, 1, 0, 1, 1])
+        # The retry step returns the attempt that passed
+        self.assertEqual(rows[0][7], 3)
+        # interval milliseconds between attempts, give or take rounding
+        self.assertTrue(rows[3][3] - rows[1][3] >= 29, rows)
+        self.assertTrue(rows[5][3] - rows[3][3] >= 29, rows)
+
+    def test_retry_gives_up(self):
+        owner = _Owner(failures=5)
+        ok, rows = self._run([{'retry' : [['flaky']], 'times' : 2}], owner)
+        self.assertFalse(ok)
+        self.assertEqual(owner.calls, [('flaky',), ('flaky',)])
+        self.assertEqual(rows[0][7], 'Step 1.1 failed 2 times')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Tests for ldtpd.sequence_step, run with python -m unittest discover tests
+
+@license: LGPL
+
+http://ldtp.freedesktop.org
+
+This file may be distributed and/or modified under the terms of the GNU Lesser General
+Public License version 2 as published by the Free Software Foundation. This file
+is distributed without any warranty; without even the implied warranty of
+merchantability or fitness for a particular purpose.
+
+See "COPYING" in the source distribution for more information.
+
+Headers in this file shall remain intact.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+# ldtpd modules use implicit relative imports, import them as top level
+# modules so the package __init__ doesn't pull in twisted
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'ldtpd'))
+try:
+    import sequence_step
+    from sequence_step import AtomicAction, PauseAction, StepScheduler
+except ImportError:
+    # Needs pyatspi and gobject
+    sequence_step = None
+
+@unittest.skipUnless(sequence_step, 'pyatspi and gobject are required')
+class JitterTest(unittest.TestCase):
+    def test_no_timings(self):
+        self.assertEqual(StepScheduler([]).jitter(), [0, 0])
+
+    def test_mean_and_max(self):
+        scheduler = StepScheduler([])
+        scheduler.timings = [[0.0, 1.0], [10.0, 14.0], [20.0, 21.0]]
+        self.assertEqual(scheduler.jitter(), [2.0, 4.0])
+
+    def test_empty_run(self):
+        scheduler = StepScheduler([])
+        self.assertTrue(scheduler.run())
+        self.assertEqual(scheduler.timings, [])
+
+if sequence_step:
+    class _Step(AtomicAction):
+        def __init__(self, delta_time, sleep=0, error=None):
+            AtomicAction.__init__(self, delta_time, self._perform)
+            self._sleep = sleep
+            self._error = error
+            self.performed = False
+
+        def _perform(self):
+            self.performed = True
+            time.sleep(self._sleep / 1000.0)
+            self.error = self._error
+
+@unittest.skipUnless(sequence_step, 'pyatspi and gobject are required')
+class DeadlineTest(unittest.TestCase):
+    def test_planned_from_previous_plan(self):
+        steps = [PauseAction(20) for i in range(5)]
+        scheduler = StepScheduler(steps)
+        self.assertTrue(scheduler.run())
+        self.assertEqual(len(scheduler.timings), 5)
+        for index, (planned, actual) in enumerate(scheduler.timings):
+            self.assertAlmostEqual(planned, (index + 1) * 20, 3)
+            # Never early
+            self.assertTrue(actual >= planned - 0.001, (planned, actual))
+
+    def test_lateness_does_not_add_up(self):
+        # The first step overruns into the second one's slot, the
+        # third one still starts on its own deadline
+        steps = [_Step(0, sleep=60), _Step(40), _Step(100)]
+        scheduler = StepScheduler(steps)
+        self.assertTrue(scheduler.run())
+        for timing, expected in zip(scheduler.timings, (0, 40, 140)):
+            self.assertAlmostEqual(timing[0], expected, 3)
+        late = [actual - planned for planned, actual in scheduler.timings]
+        self.assertTrue(late[1] >= 20, late)
+        self.assertTrue(late[2] < 50, late)
+        self.assertEqual(scheduler.jitter()[1], max(late))
+
+    def test_origin(self):
+        origin = sequence_step._monotonic() - 1
+        scheduler = StepScheduler([PauseAction(10)], origin)
+        scheduler.run()
+        planned, actual = scheduler.timings[0]
+        self.assertTrue(1010 <= planned < 1500, planned)
+        self.assertTrue(actual >= planned - 0.001)
+
+    def test_failed_step_ends_chain(self):
+        steps = [_Step(0), _Step(0, error='failed'), _Step(0)]
+        scheduler = StepScheduler(steps)
+        self.assertFalse(scheduler.run())
+        self.assertTrue(scheduler.failed is steps[1])
+        self.assertEqual([step.performed for step in steps],
+                         [True, True, False])
+        self.assertEqual(len(scheduler.timings), 2)
+
+if __name__ == '__main__':
+    unittest.main()